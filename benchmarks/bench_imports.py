@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+## third party packages that should only be imported by the stages that need them
+HEAVY_MODULES = ['azure.cognitiveservices.speech', 'azure.mgmt.media', 'azure.storage.blob', 'azure.identity', 'bs4', 'rich', 'dotenv', 'numpy']
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+COMMAND_PROBE = """
+import sys, json, time, runpy
+start = time.perf_counter()
+sys.argv = {argv!r}
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+sys.stdout = sys.__stdout__
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def probe(code):
+    ## every measurement runs in a fresh interpreter so nothing is already imported
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(code, repeat):
+    runs = [probe(code) for _ in range(repeat)]
+    seconds = [run['seconds'] for run in runs]
+    return {'median_seconds': statistics.median(seconds), 'min_seconds': min(seconds), 'heavy_modules_loaded': runs[-1]['loaded']}
+
+
+def run(repeat=5):
+    modules = ['ttml2speech.TTMLConverter', 'ttml2speech.DubbingWorker', 'ttml2speech.SpeechBackends']
+    commands = {
+        'convert_ttml_to_speech --help': ['convert_ttml_to_speech.py', '--help'],
+        'convert_mp3_to_aacmp4 --help': ['convert_mp3_to_aacmp4.py', '--help'],
+    }
+    report = {'python': sys.version.split()[0], 'repeat': repeat, 'imports': {}, 'commands': {}}
+    for module in modules:
+        report['imports'][module] = measure(IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES), repeat)
+    for name, argv in commands.items():
+        ## --help output is swallowed so only the JSON line reaches us
+        code = "import io, sys; sys.stdout = io.StringIO()\n" + COMMAND_PROBE.format(argv=argv, heavy=HEAVY_MODULES)
+        report['commands'][name] = measure(code, repeat)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time module imports and CLI startup in fresh interpreters')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per measurement; the median is reported')
+    args = parser.parse_args()
+    json.dump(run(args.repeat), sys.stdout, indent=4)
+    print()
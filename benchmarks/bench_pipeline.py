@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+
+from benchmarks.synthetic_ttml import write_synthetic_ttml
+from ttml2speech.TTMLConverter import TTMLConverter
+from ttml2speech.SpeechBackends import LocalSpeechBackend
+from ttml2speech.BatchPartitioner import BatchPartitioner
+from ttml2speech.SentenceTable import numpy_module
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        result[f"p{p}"] = ordered[index]
+    result['max'] = ordered[-1]
+    return result
+
+
+def peak_rss_bytes():
+    ## ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class TimedBackend(LocalSpeechBackend):
+    ## LocalSpeechBackend that records the latency of every request
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+
+    def synthesize(self, ssml, voice_name, voice_language, output_format):
+        start = time.perf_counter()
+        audio_data = super().synthesize(ssml, voice_name, voice_language, output_format)
+        self.latencies.append(time.perf_counter() - start)
+        return audio_data
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, items=None, backend=None):
+        if backend is not None:
+            backend.latencies = []
+        start = time.perf_counter()
+        ## the converter prints per sentence; keep that out of the measurement
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+        elapsed = time.perf_counter() - start
+        stage = {'seconds': elapsed, 'peak_rss_bytes': peak_rss_bytes()}
+        if items is not None:
+            stage['items'] = items() if callable(items) else items
+            stage['items_per_second'] = stage['items'] / elapsed if elapsed else None
+        if backend is not None:
+            stage['request_latency'] = percentiles(backend.latencies)
+        self.stages[name] = stage
+
+
+def run_once(ttml_path, concurrency, latency, assembly, batching='packed'):
+    timer = StageTimer()
+    ## the converter loads NumPy on first use; load it up front so the one-off import is not timed as a stage
+    numpy_module()
+    converter = TTMLConverter(ttml_file_path=ttml_path, output_staging_directory='benchmark', prefix='bench')
+    converter.voice_name = 'bench-voice'
+    converter.voice_language = 'en-US'
+    backend = TimedBackend(latency_seconds=latency)
+    converter.synthesis_backend = backend
+    if batching == 'packed':
+        converter.batch_partitioner = BatchPartitioner()
+
+    with timer.stage('combine_ttml_to_sentences', items=lambda: len(sentences_list)):
+        sentences_list = converter.combine_ttml_to_sentences()
+    with timer.stage('synthesis_pass_1', items=len(sentences_list), backend=backend):
+        converter.pre_process_audio_snippets(sentences_list, max_concurrency=concurrency)
+    with timer.stage('calculate_prosody_rates', items=len(sentences_list)):
+        adjustments_dict = converter.calculate_prosody_rates(sentences_list)
+    with timer.stage('synthesis_pass_2', items=len(sentences_list), backend=backend):
+        converter.pre_process_audio_snippets(sentences_list, clip_audio_directory='prosody_adjusted', avg_prosody_rate=round(adjustments_dict['avg_prosody'], 1), max_concurrency=concurrency)
+    with timer.stage('break_sentences_into_batches', items=len(sentences_list)):
+        sentence_batch_dict = converter.break_sentences_into_batches(sentences_list)
+    with timer.stage('build_ssml', items=len(sentence_batch_dict)):
+        start_file_time = "00:00:00.000"
+        for index, batch in sentence_batch_dict.items():
+            converter.build_ssml(batch, output_files=False, file_start=start_file_time)
+            start_file_time = batch[-1]['end']
+    with timer.stage(f'assembly_{assembly}', items=len(sentences_list), backend=backend):
+        converter.assemble_final_audio(sentences_list, assembly=assembly, max_concurrency=concurrency)
+
+    return {'sentences': len(sentences_list), 'total_seconds': sum(s['seconds'] for s in timer.stages.values()), 'stages': timer.stages}
+
+
+def run(durations_minutes, concurrency=4, latency=0.0, assembly='stitch', batching='packed'):
+    results = []
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ## the converter stages everything under ./outputs
+        os.chdir(temp_dir)
+        try:
+            for minutes in durations_minutes:
+                ttml_path = os.path.join(temp_dir, f'synthetic_{minutes}.ttml')
+                phrases = write_synthetic_ttml(ttml_path, duration_minutes=minutes)
+                row = {'duration_minutes': minutes, 'phrases': phrases, 'ttml_bytes': os.path.getsize(ttml_path)}
+                row.update(run_once(ttml_path, concurrency, latency, assembly, batching))
+                results.append(row)
+        finally:
+            os.chdir(working_directory)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'concurrency': concurrency, 'latency_seconds': latency, 'assembly': assembly, 'batching': batching},
+        'runs': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time each dubbing pipeline stage against the offline local backend')
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 10, 60, 180], help='lengths of synthetic caption timelines to generate')
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated seconds per synthesis request')
+    parser.add_argument('--assembly', choices=['ssml', 'stitch'], default='stitch')
+    parser.add_argument('--batching', choices=['packed', 'minutes'], default='packed')
+    parser.add_argument('--output', type=str, default=None, help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args.minutes, concurrency=args.concurrency, latency=args.latency, assembly=args.assembly, batching=args.batching)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
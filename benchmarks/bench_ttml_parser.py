@@ -0,0 +1,82 @@
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.synthetic_ttml import write_synthetic_ttml
+from ttml2speech.TTMLParser import iter_ttml_sentences
+
+
+def legacy_combine_ttml_to_sentences(ttml_file_path):
+    ## The BeautifulSoup implementation that TTMLConverter used before the streaming parser,
+    ## kept here as the baseline for comparison.
+    from bs4 import BeautifulSoup
+    with open(ttml_file_path, 'r', encoding="utf-8") as f:
+        ttml_text = f.read()
+    sentences_list = []
+    sentence_dict = {'text': '', 'begin': '', 'end': ''}
+    soup = BeautifulSoup(ttml_text, features="html.parser")
+    for phrase in soup.select('p'):
+        if not sentence_dict['begin']:
+            sentence_dict['begin'] = phrase['begin']
+        else:
+            sentence_dict['begin'] = min(phrase['begin'], sentence_dict['begin'])
+        sentence_dict['end'] = max(phrase['end'], sentence_dict['end'])
+        if not sentence_dict['text']:
+            sentence_dict['text'] = phrase.text.strip()
+        else:
+            sentence_dict['text'] = sentence_dict['text'] + " " + phrase.text.strip()
+        if phrase.text[-1] in ".!?":
+            begin = datetime.strptime(sentence_dict["begin"], "%H:%M:%S.%f")
+            end = datetime.strptime(sentence_dict["end"], "%H:%M:%S.%f")
+            sentence_dict['target_duration'] = (end - begin).total_seconds()
+            sentence_dict['character_length'] = len(sentence_dict['text'])
+            sentences_list.append(sentence_dict)
+            sentence_dict = {'text': '', 'begin': '', 'end': ''}
+    return sentences_list
+
+
+def streaming_combine_ttml_to_sentences(ttml_file_path):
+    return list(iter_ttml_sentences(ttml_file_path))
+
+
+def measure(parse, ttml_file_path):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    sentences = parse(ttml_file_path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sentences, {'seconds': elapsed, 'peak_traced_bytes': peak, 'sentences': len(sentences)}
+
+
+def run(durations_minutes, include_legacy=True):
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for minutes in durations_minutes:
+            path = os.path.join(temp_dir, f'synthetic_{minutes}.ttml')
+            phrases = write_synthetic_ttml(path, duration_minutes=minutes)
+            row = {'duration_minutes': minutes, 'phrases': phrases, 'file_bytes': os.path.getsize(path)}
+            streamed, row['streaming'] = measure(streaming_combine_ttml_to_sentences, path)
+            if include_legacy:
+                legacy, row['legacy'] = measure(legacy_combine_ttml_to_sentences, path)
+                ## the streaming parser also carries numeric begin/end seconds, compare the shared keys
+                row['outputs_match'] = legacy == [{k: s[k] for k in legacy_sentence} for s, legacy_sentence in zip(streamed, legacy)] and len(legacy) == len(streamed)
+                row['speedup'] = row['legacy']['seconds'] / row['streaming']['seconds']
+            results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the streaming TTML parser with the BeautifulSoup parser')
+    parser.add_argument('--minutes', type=int, nargs='+', default=[10, 60, 180])
+    parser.add_argument('--skip-legacy', action='store_true', help='only time the streaming parser (no bs4 needed)')
+    args = parser.parse_args()
+    json.dump(run(args.minutes, include_legacy=not args.skip_legacy), sys.stdout, indent=4)
+    print()
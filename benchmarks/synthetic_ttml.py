@@ -0,0 +1,38 @@
+import random
+from xml.sax.saxutils import escape
+
+from ttml2speech.TTMLParser import format_timestamp
+
+WORDS = (
+    "the data report dashboard filter you can show how we will build a model with power "
+    "query table visual measure column each value help your team make decisions faster"
+).split()
+
+
+def synthetic_phrases(duration_seconds, seed=0):
+    ## Caption phrases of 2-5 seconds; roughly every third phrase ends a sentence
+    rng = random.Random(seed)
+    t = rng.uniform(0, 2)
+    while t < duration_seconds:
+        length = rng.uniform(2, 5)
+        words = rng.choices(WORDS, k=rng.randint(4, 10))
+        text = " ".join(words)
+        if rng.random() < 0.35:
+            text += rng.choice(".!?")
+        yield t, min(t + length, duration_seconds), text
+        t += length + rng.uniform(0, 0.5)
+
+
+def write_synthetic_ttml(path, duration_minutes=60, seed=0):
+    ## Writes a TTML document in the same shape as the Video Analyzer captions
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<tt xml:lang="en-US" xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling" xmlns:ttm="http://www.w3.org/ns/ttml#metadata">\n')
+        f.write('  <body region="CaptionArea">\n    <div>\n')
+        count = 0
+        for begin, end, text in synthetic_phrases(duration_minutes * 60, seed):
+            f.write(f'      <!-- Confidence: 0.9 -->\n')
+            f.write(f'      <p begin="{format_timestamp(begin)}" end="{format_timestamp(end)}">{escape(text)}</p>\n\n')
+            count += 1
+        f.write('    </div>\n  </body>\n</tt>\n')
+    return count
@@ -1,177 +1,194 @@
 import os, uuid, sys
-import time #Timer for checking job progress
-import random #This is only necessary for the random number generation
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.media import AzureMediaServices
-from azure.storage.blob import BlobServiceClient
-from azure.mgmt.media.models import (
-  Asset,
-  Transform,
-  TransformOutput,
-  BuiltInStandardEncoderPreset,
-  Job,
-  JobInputAsset,
-  JobOutputAsset
-)
-from dotenv import load_dotenv
-from rich import pretty
+import argparse
 from pprint import pprint
 
-load_dotenv()
-pretty.install()
-
-translated_audio_file_name = "fr-FR_generated_audio.mp3"
-translated_audio_file_path = 'outputs\\berry_fr\\fr-FR_generated_audio.mp3'
-original_video_media_services_asset_id = "" ## the video that needs dubbing
-asset_name = "berry_fr-FR"
-asset_description = "Language track for fr-FR for Berry video"
-
-
-## environment variables
-tenant_id = os.environ['TENANT_ID']
-client_id=os.environ['AADCLIENTID']
-client_secret = os.environ['AADSECRET']
-subscription_id = os.environ['SUBSCRIPTION_ID']
-resource_group_name = os.environ['RESOURCE_GROUP_NAME']
-account_name = os.environ['MEDIA_SERVICES_ACCOUNT_NAME']
-storage_account_connection = os.getenv('STORAGEACCOUNTCONNECTION')
-
-blob_service_client = BlobServiceClient(
-    account_url = os.environ['STORAGE_ACCOUNT_BLOB_ENDPOINT'],
-    credential = os.environ['STORAGE_ACCOUNT_KEY']
-)
-
-# Get the default Azure credential from the environment variables AADCLIENTID and AADSECRET
-default_credential = DefaultAzureCredential()
-uniqueness = random.randint(0,9999)
-
-# Create an Asset object
-# The asset_id will be used for the container parameter for the storage SDK after the asset is created by the AMS client.
-in_asset_name = f'{asset_name}' + '_in_' 
-in_alternate_id = f'{asset_name}_inputALTid' 
-in_description = f'in: {asset_description}' 
-
-input_asset = Asset(alternate_id=in_alternate_id, description=in_description)
-
-# Set the attributes of the output Asset using the random number
-out_asset_name = f'{asset_name}' + '_out_' 
-out_alternate_id = f'{asset_name}_outputALTid' 
-out_description = f'Out: {asset_description}' 
-
-# From the SDK
-# Asset(*, alternate_id: str = None, description: str = None, container: str = None, storage_account_name: str = None, **kwargs) -> None
-output_asset = Asset(alternate_id=out_alternate_id,description=out_description)
-
-# The AMS Client
-print("Creating AMS client")
-# From SDK
-# AzureMediaServices(credentials, subscription_id, base_url=None)
-client = AzureMediaServices(default_credential, subscription_id)
-
-# Create an input Asset
-print("Creating input asset " + in_asset_name)
-# From SDK
-# create_or_update(resource_group_name, account_name, asset_name, parameters, custom_headers=None, raw=False, **operation_config)
-inputAsset = client.assets.create_or_update(
-  resource_group_name, 
-  account_name, 
-  in_asset_name, 
-  input_asset
-)
-
-# An AMS asset is a container with a specific id that has "asset-" prepended to the GUID.
-# So, you need to create the asset id to identify it as the container
-# where Storage is to upload the video (as a block blob)
-in_container = 'asset-' + inputAsset.asset_id
-print(f'Input Container: {in_container}')
-
-# create an output Asset
-print("Creating output asset " + out_asset_name)
-# From SDK
-# create_or_update(resource_group_name, account_name, asset_name, parameters, custom_headers=None, raw=False, **operation_config)
-outputAsset = client.assets.create_or_update(resource_group_name, account_name, out_asset_name, output_asset)
-
-### Use the Storage SDK to upload the video ###
-print("Uploading the file " + translated_audio_file_path)
-blob_client = blob_service_client.get_blob_client(in_container, translated_audio_file_name)
-working_dir = os.getcwd()
-print("Current working directory:" + working_dir)
-upload_file_path = os.path.join(working_dir, translated_audio_file_path)
-print(upload_file_path)
-
-# Upload the video to storage as a block blob
-with open(upload_file_path, "rb") as data:
-  # From SDK
-  # upload_blob(data, blob_type=<BlobType.BlockBlob: 'BlockBlob'>, length=None, metadata=None, **kwargs)
-    blob_client.upload_blob(data, overwrite=True)
-
-### Create a Transform ###
-transform_name='ConvertToAAC'
-# From SDK
-# TransformOutput(*, preset, on_error=None, relative_priority=None, **kwargs) -> None
-transform_output = TransformOutput(
-    preset=BuiltInStandardEncoderPreset(preset_name="AACGoodQualityAudio")
-)
-transform = Transform()
-transform.outputs = [transform_output]
-
-print("Creating transform " + transform_name)
-# From SDK
-# Create_or_update(resource_group_name, account_name, transform_name, outputs, description=None, custom_headers=None, raw=False, **operation_config)
-transform = client.transforms.create_or_update(
-  resource_group_name=resource_group_name,
-  account_name=account_name,
-  transform_name=transform_name,
-  parameters = transform
-)
-
-### Create a Job ###
-job_name = f'Convert to AAC MP4 - {asset_name}'
-print("Creating job " + job_name)
-files =  (translated_audio_file_path)
-# From SDK
-# JobInputAsset(*, asset_name: str, label: str = None, files=None, **kwargs) -> None
-input = JobInputAsset(asset_name=in_asset_name)
-# From SDK
-# JobOutputAsset(*, asset_name: str, **kwargs) -> None
-outputs = JobOutputAsset(asset_name=out_asset_name)
-# From SDK
-# Job(*, input, outputs, description: str = None, priority=None, correlation_data=None, **kwargs) -> None
-theJob = Job(input=input,outputs=[outputs])
-# From SDK
-# Create(resource_group_name, account_name, transform_name, job_name, parameters, custom_headers=None, raw=False, **operation_config)
-job: Job = client.jobs.create(resource_group_name,account_name,transform_name,job_name,parameters=theJob)
-
-### Check the progress of the job ### 
-# From SDK
-# get(resource_group_name, account_name, transform_name, job_name, custom_headers=None, raw=False, **operation_config)
-job_state = client.jobs.get(resource_group_name,account_name,transform_name,job_name)
-# First check
-print("First job check")
-print(job_state.state)
-
-# Check the state of the job every 10 seconds. Adjust time_in_seconds = <how often you want to check for job state>
-def countdown(t):
-    while t: 
-        mins, secs = divmod(t, 60) 
-        timer = '{:02d}:{:02d}'.format(mins, secs) 
-        print(timer, end="\r") 
-        time.sleep(1) 
-        t -= 1
-    job_current = client.jobs.get(resource_group_name,account_name,transform_name,job_name)
-    if(job_current.state == "Finished"):
-      print(job_current.state)
-      # TODO: Download the output file using blob storage SDK
-      return
-    if(job_current.state == "Error"):
-      print(job_current.state)
-      # TODO: Provide Error details from Job through API
-      return
-    else:
-      print(job_current.state)
-      countdown(int(time_in_seconds))
-
-time_in_seconds = 10
-countdown(int(time_in_seconds))
-
-outputAsset.asset_id
\ No newline at end of file
+## The Azure SDKs are imported inside main(), only on the paths that use them, so --help and the
+## local encoder start without loading them.
+
+
+def locale_from_path(path):
+    ## outputs/<run>/fr-FR_generated_audio.mp3 -> fr-FR
+    return os.path.basename(path).split('_generated_audio')[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-i', '--infile', action='append', required=True, help='generated audio to convert, e.g. outputs/berry_fr/fr-FR_generated_audio.mp3; repeat for every locale. The local encoder also takes the WAV timeline or an enriched_sentences.json')
+    parser.add_argument('--encoder', choices=['cloud', 'local'], default='cloud', help='encode with a Media Services job, or locally with ffmpeg in a process pool')
+    parser.add_argument('--bitrate', default='128k', type=str, help='AAC bitrate for the local encoder')
+    parser.add_argument('--encode-workers', default=None, type=int, help='locales encoded at once by the local encoder (default: CPU count)')
+    parser.add_argument('--output-directory', default=None, type=str, help='where the local encoder writes the MP4 files (default: next to each input)')
+    parser.add_argument('--asset-name', default='dub', type=str, help='asset name prefix, the locale is appended')
+    parser.add_argument('--asset-description', default='Language track', type=str)
+    parser.add_argument('--block-size-mb', default=4, type=float, help='size of each staged block')
+    parser.add_argument('--upload-concurrency', default=8, type=int, help='blocks staged at once, across all files')
+    parser.add_argument('--storage-connection-string', default=None, type=str, help='storage connection string, e.g. "UseDevelopmentStorage=true" for Azurite (default: STORAGEACCOUNTCONNECTION, then STORAGE_ACCOUNT_BLOB_ENDPOINT and STORAGE_ACCOUNT_KEY)')
+    parser.add_argument('--upload-only', action='store_true', help='only upload the files to --container, without Media Services')
+    parser.add_argument('--container', default='dubbing-audio', type=str, help='container used by --upload-only')
+    parser.add_argument('--poll-interval', default=2, type=float, help='seconds before the first job state check; grows while the state is unchanged')
+    parser.add_argument('--max-poll-interval', default=30, type=float, help='longest wait between job state checks')
+    parser.add_argument('--job-timeout', default=None, type=float, help='stop waiting for a job after this many seconds')
+    parser.add_argument('--download-directory', default=os.path.join('outputs', 'aac'), type=str, help='where the encoded output assets are downloaded')
+    parser.add_argument('--download-concurrency', default=4, type=int, help='output blobs downloaded at once, across all jobs')
+    args = parser.parse_args()
+
+    if args.encoder == 'local':
+        from ttml2speech.LocalEncoder import LocalAacEncoder
+        encoder = LocalAacEncoder(max_workers=args.encode_workers, bitrate=args.bitrate, output_directory=args.output_directory)
+        results = encoder.encode_all(args.infile)
+        pprint(results)
+        if any(isinstance(result, Exception) for result in results.values()):
+            sys.exit(1)
+        return
+
+    from dotenv import load_dotenv
+    from ttml2speech.BlockBlobUploader import BlockBlobUploader, blob_service_client_from_environment
+    load_dotenv()
+
+    blob_service_client = blob_service_client_from_environment(args.storage_connection_string)
+    uploader = BlockBlobUploader(blob_service_client, block_size=int(args.block_size_mb * 1024 * 1024), max_concurrency=args.upload_concurrency)
+
+    if args.upload_only:
+        from azure.core.exceptions import ResourceExistsError
+        try:
+            blob_service_client.create_container(args.container)
+        except ResourceExistsError:
+            pass
+        urls = uploader.upload([(args.container, os.path.basename(path), path) for path in args.infile])
+        pprint(urls)
+        print(f"Upload: {uploader.stats}")
+        return
+
+    import asyncio
+    from azure.identity import DefaultAzureCredential
+    from azure.mgmt.media import AzureMediaServices
+    from azure.mgmt.media.models import (
+      Asset,
+      Transform,
+      TransformOutput,
+      BuiltInStandardEncoderPreset,
+      Job,
+      JobInputAsset,
+      JobOutputAsset
+    )
+    from ttml2speech.JobMonitor import JobMonitor
+
+    ## environment variables
+    subscription_id = os.environ['SUBSCRIPTION_ID']
+    resource_group_name = os.environ['RESOURCE_GROUP_NAME']
+    account_name = os.environ['MEDIA_SERVICES_ACCOUNT_NAME']
+
+    # Get the default Azure credential from the environment variables AADCLIENTID and AADSECRET
+    default_credential = DefaultAzureCredential()
+
+    # The AMS Client
+    print("Creating AMS client")
+    # From SDK
+    # AzureMediaServices(credentials, subscription_id, base_url=None)
+    client = AzureMediaServices(default_credential, subscription_id)
+
+    ### Create a Transform ###
+    transform_name='ConvertToAAC'
+    # From SDK
+    # TransformOutput(*, preset, on_error=None, relative_priority=None, **kwargs) -> None
+    transform_output = TransformOutput(
+        preset=BuiltInStandardEncoderPreset(preset_name="AACGoodQualityAudio")
+    )
+    transform = Transform()
+    transform.outputs = [transform_output]
+
+    print("Creating transform " + transform_name)
+    # From SDK
+    # Create_or_update(resource_group_name, account_name, transform_name, outputs, description=None, custom_headers=None, raw=False, **operation_config)
+    transform = client.transforms.create_or_update(
+      resource_group_name=resource_group_name,
+      account_name=account_name,
+      transform_name=transform_name,
+      parameters = transform
+    )
+
+    ## one input and one output asset per locale
+    locales = []
+    for translated_audio_file_path in args.infile:
+        locale = locale_from_path(translated_audio_file_path)
+        asset_name = f"{args.asset_name}_{locale}"
+        asset_description = f"{args.asset_description} for {locale}"
+
+        # Create an Asset object
+        # The asset_id will be used for the container parameter for the storage SDK after the asset is created by the AMS client.
+        in_asset_name = f'{asset_name}' + '_in_'
+        in_alternate_id = f'{asset_name}_inputALTid'
+        in_description = f'in: {asset_description}'
+        input_asset = Asset(alternate_id=in_alternate_id, description=in_description)
+
+        out_asset_name = f'{asset_name}' + '_out_'
+        out_alternate_id = f'{asset_name}_outputALTid'
+        out_description = f'Out: {asset_description}'
+        output_asset = Asset(alternate_id=out_alternate_id,description=out_description)
+
+        # Create an input Asset
+        print("Creating input asset " + in_asset_name)
+        # From SDK
+        # create_or_update(resource_group_name, account_name, asset_name, parameters, custom_headers=None, raw=False, **operation_config)
+        inputAsset = client.assets.create_or_update(resource_group_name, account_name, in_asset_name, input_asset)
+
+        # An AMS asset is a container with a specific id that has "asset-" prepended to the GUID.
+        # So, you need to create the asset id to identify it as the container
+        # where Storage is to upload the video (as a block blob)
+        in_container = 'asset-' + inputAsset.asset_id
+        print(f'Input Container: {in_container}')
+
+        # create an output Asset
+        print("Creating output asset " + out_asset_name)
+        client.assets.create_or_update(resource_group_name, account_name, out_asset_name, output_asset)
+
+        locales.append({
+            'locale': locale,
+            'asset_name': asset_name,
+            'path': translated_audio_file_path,
+            'in_asset_name': in_asset_name,
+            'out_asset_name': out_asset_name,
+            'in_container': in_container,
+        })
+
+    ### Use the Storage SDK to upload the audio for every locale at once, block by block ###
+    print(f"Uploading {len(locales)} files")
+    uploader.upload([(l['in_container'], os.path.basename(l['path']), l['path']) for l in locales])
+    print(f"Upload: {uploader.stats}")
+
+    ### Create a Job per locale, then track them all at once ###
+    jobs = []
+    for l in locales:
+        job_name = f"Convert to AAC MP4 - {l['asset_name']}"
+        print("Creating job " + job_name)
+        # From SDK
+        # JobInputAsset(*, asset_name: str, label: str = None, files=None, **kwargs) -> None
+        input = JobInputAsset(asset_name=l['in_asset_name'])
+        # From SDK
+        # JobOutputAsset(*, asset_name: str, **kwargs) -> None
+        outputs = JobOutputAsset(asset_name=l['out_asset_name'])
+        # From SDK
+        # Job(*, input, outputs, description: str = None, priority=None, correlation_data=None, **kwargs) -> None
+        theJob = Job(input=input,outputs=[outputs])
+        jobs.append({'job_name': job_name, 'job': theJob, 'output_asset_name': l['out_asset_name']})
+
+    monitor = JobMonitor(
+        client,
+        resource_group_name,
+        account_name,
+        transform_name,
+        blob_service_client=blob_service_client,
+        initial_interval=args.poll_interval,
+        max_interval=args.max_poll_interval,
+        timeout=args.job_timeout,
+        max_parallel_downloads=args.download_concurrency
+    )
+    results = asyncio.run(monitor.submit_and_track(jobs, download_directory=args.download_directory))
+    pprint(results)
+    if any(result['state'] != 'Finished' for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,46 +2,101 @@ import os
 import argparse
 import random
 import string
+import shutil
 
 from ttml2speech.TTMLConverter import TTMLConverter
-from dotenv import load_dotenv
-from rich import pretty
-pretty.install()
+from ttml2speech.SynthesisCache import SynthesisCache
+from ttml2speech.AudioStitcher import AudioStitcher
+from ttml2speech.DubbingPipeline import DubbingPipeline
+from ttml2speech.RequestScheduler import RequestScheduler
+from ttml2speech.MultiTargetDubbing import MultiTargetDubbing
+from ttml2speech.SpeechBackends import LocalSpeechBackend, AzureSpeechBackend
+from ttml2speech.Instrumentation import Metrics, sink_from_spec
+from ttml2speech.TimingSolver import TimingSolver
+from ttml2speech.BatchPartitioner import BatchPartitioner
+from ttml2speech.DubbingWorker import DubbingWorker
+import json
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    ## Read environment file values first
-    load_dotenv()
-    speech_key = os.environ['SPEECH_KEY']
-    service_region = os.environ['SERVICE_REGION']
         
     ## Define Command Line Args
-    parser.add_argument('-i', '--infile', type=str, help='input ttml file path')
+    parser.add_argument('-i', '--infile', type=str, help='input ttml file path, or a directory or glob pattern to dub many files in one process')
     parser.add_argument('-o', '--outputdirectory', type=str, default="output", help='output directory')
     parser.add_argument('-v', '--voice', required=False, default=None, type=str)
     parser.add_argument('-l', '--language', required=False, default=None, type=str)
+    parser.add_argument('-t', '--target', action='append', default=[], metavar='VOICE:LANGUAGE', help='dub into this voice/locale; repeat to fan out to several voices or locales in one run')
     parser.add_argument('-p', '--prefix', default="".join(random.choices(string.ascii_letters, k=3)), type=str)
+    parser.add_argument('--cache-directory', default=os.path.join('outputs', '.synthesis_cache'), type=str, help='directory for the persistent synthesis cache')
+    parser.add_argument('--cache-size-mb', default=2048, type=int, help='size past which the synthesis cache is trimmed to 90%%, least recently used first')
+    parser.add_argument('--no-cache', action='store_true', help='always call the speech service instead of reusing cached audio')
+    parser.add_argument('--predictive', action='store_true', help='predict durations at the averaged prosody rate from a sample instead of a full second synthesis pass')
+    parser.add_argument('--prediction-sample-size', default=10, type=int, help='number of sentences re-synthesized to fit the duration model in --predictive mode')
+    parser.add_argument('--assembly', choices=['ssml', 'stitch'], default='ssml', help='build the final audio by re-synthesizing batched SSML, or by stitching the sentence clips locally')
+    parser.add_argument('--overlap', choices=['shift', 'truncate'], default='shift', help='how stitched clips that run into the next sentence are handled')
+    parser.add_argument('--prosody-mode', choices=['average', 'solve'], default='average', help='one averaged prosody rate for the whole file, or a solved rate per sentence that keeps timeline drift under --drift-target')
+    parser.add_argument('--min-rate', default=0.8, type=float, help='slowest prosody rate the timing solver may pick for a sentence that underfills its slot')
+    parser.add_argument('--min-fill', default=0.7, type=float, help='fraction of its caption slot below which the timing solver slows a sentence down')
+    parser.add_argument('--max-rate', default=1.5, type=float, help='fastest prosody rate the timing solver may pick')
+    parser.add_argument('--drift-target', default=0.5, type=float, help='seconds a sentence may start late before the timing solver speeds it up')
+    parser.add_argument('--batching', choices=['packed', 'minutes'], default='packed', help='pack final synthesis batches by predicted audio length and SSML size, splitting at pauses, or bucket them by 5 minute marks')
+    parser.add_argument('--max-batch-seconds', default=540, type=float, help='predicted audio length a packed batch may not exceed (the service caps one request at 10 minutes)')
+    parser.add_argument('--encode-aac', action='store_true', help='also encode each locale\'s final audio to AAC in MP4 locally with ffmpeg (use with --assembly stitch or --pipeline to encode straight from PCM)')
+    parser.add_argument('--pipeline', action='store_true', help='overlap parsing, synthesis and stitching in one streaming pass at a fixed prosody rate')
+    parser.add_argument('--pipeline-queue-size', default=16, type=int, help='sentences allowed to wait between pipeline stages')
+    parser.add_argument('--prosody-rate', default=1, type=float, help='prosody rate used by --pipeline')
+    parser.add_argument('--previous', type=str, default=None, metavar='ENRICHED_SENTENCES_JSON', help="re-dub against an earlier run's enriched_sentences.json, synthesizing only changed sentences and batches")
+    parser.add_argument('--resume', action='store_true', help='keep the output directory and only synthesize sentences the job manifest has not recorded as done')
+    parser.add_argument('--requests-per-second', default=20, type=float, help='transactions per second allowed by the speech resource tier')
+    parser.add_argument('--max-retries', default=5, type=int, help='retries for a throttled or failed synthesis request before it is dead-lettered')
+    parser.add_argument('--backend', choices=['azure', 'local'], default='azure', help='speech service to synthesize with; local is an offline stand-in for benchmarking')
+    parser.add_argument('--local-latency', default=0.0, type=float, help='simulated seconds per request for the local backend')
+    parser.add_argument('--local-error-rate', default=0.0, type=float, help='fraction of local backend requests that fail')
+    parser.add_argument('--local-throttle-rate', default=0.0, type=float, help='fraction of local backend requests that are throttled')
+    parser.add_argument('--local-seed', default=0, type=int, help='random seed for the local backend latency and error injection')
+    parser.add_argument('-q', '--quiet', action='store_true', help='suppress the per-sentence console output')
+    parser.add_argument('--metrics-sink', action='append', default=[], metavar='SPEC', help='export spans and counters: jsonl:PATH, prometheus:PATH or otel (repeatable)')
+    parser.add_argument('--manifest', type=str, default=None, help='dub every job in this JSON/JSON lines file of {"infile", "voice", "language", "name"} in one process')
+    parser.add_argument('--watch', type=str, default=None, metavar='DIRECTORY', help='run as a long-lived worker dubbing every TTML file dropped into this directory')
+    parser.add_argument('--poll-interval', default=5, type=float, help='seconds between scans of the --watch directory')
+    parser.add_argument('--max-jobs', default=4, type=int, help='files dubbed at the same time in multi-file and worker modes; they share the -c request slots fairly')
+    parser.add_argument('-c', '--concurrency', default=1, type=int, help='maximum number of sentence synthesis requests in flight at once')
 
     args = parser.parse_args()
 
+    ## the single file modes replace each other, so combining them would silently drop one
+    exclusive_modes = [option for option, value in (('--target', args.target), ('--pipeline', args.pipeline), ('--previous', args.previous)) if value]
+    if len(exclusive_modes) > 1:
+        parser.error(f"{' and '.join(exclusive_modes)} cannot be combined")
+    if args.pipeline and args.prosody_mode == 'solve':
+        parser.error("--pipeline synthesizes at the fixed --prosody-rate and cannot be combined with --prosody-mode solve")
+    if args.predictive and args.assembly == 'stitch':
+        ## predictive mode only synthesizes a sample at the adjusted rate, the other clips are at the default rate
+        parser.error("--predictive cannot be combined with --assembly stitch")
+
+    ## Read environment file values (after parsing, so --help doesn't pay for it)
+    from dotenv import load_dotenv
+    load_dotenv()
+
     ## Assing command line args
     # input_ttml = args.infile
     input_ttml = args.infile 
     output_directory = args.outputdirectory
     prefix = args.prefix
-    voice_name = args.voice if args.voice else os.environ['VOICE_NAME']
-    voice_language = args.language if args.language else os.environ['VOICE_LANGUAGE']
+    max_concurrency = max(1, args.concurrency)
+    voice_name = args.voice if args.voice else os.environ.get('VOICE_NAME')
+    voice_language = args.language if args.language else os.environ.get('VOICE_LANGUAGE')
     
-    if not (input_ttml):
+    if not (input_ttml) and not (args.manifest or args.watch):
         try:
             input_ttml = os.environ['INPUT_TTML_PATH']
         except Exception as e:
             print("You must provide an input path as command line arguements, or as an environment variable.")
             raise e 
 
-    if not (voice_language and voice_name):
+    if not (voice_language and voice_name) and not args.target:
         try:
             voice_name = os.environ['VOICE_NAME']
             voice_language = os.environ['VOICE_LANGUAGE']
@@ -49,54 +104,187 @@ if __name__ == "__main__":
             print("You will need to provide a valid voice name and voice language/locale as a command line argument or as an environment variable.")
             raise e 
 
-    try:
-        speech_key = os.environ['SPEECH_KEY']
-        service_region = os.environ['SERVICE_REGION']
-    except Exception as e:
-        print("You must provide a SPEECH_KEY and SERVICE_REGION as an environment variable or .env file.")
-        raise e
+    speech_key = os.environ.get('SPEECH_KEY', '')
+    service_region = os.environ.get('SERVICE_REGION', '')
+    if args.backend == 'azure':
+        try:
+            speech_key = os.environ['SPEECH_KEY']
+            service_region = os.environ['SERVICE_REGION']
+        except Exception as e:
+            print("You must provide a SPEECH_KEY and SERVICE_REGION as an environment variable or .env file.")
+            raise e
 
 
 
     ## Run the Stuff
-    ## Create the TTML Converter Object
-    my_converter = TTMLConverter(ttml_file_path=input_ttml, output_staging_directory=output_directory, prefix=prefix)
+    ## Shared by every converter in this process
+    metrics = Metrics(sinks=[sink_from_spec(spec) for spec in args.metrics_sink])
+    request_scheduler = RequestScheduler(
+        requests_per_second=args.requests_per_second,
+        max_concurrency=max_concurrency,
+        max_retries=args.max_retries,
+        metrics=metrics
+    )
+    if args.backend == 'local':
+        synthesis_backend = LocalSpeechBackend(
+            latency_seconds=args.local_latency,
+            error_rate=args.local_error_rate,
+            throttle_rate=args.local_throttle_rate,
+            seed=args.local_seed
+        )
+    else:
+        ## the first request that misses the cache opens -c connections at once
+        synthesis_backend = AzureSpeechBackend(speech_key, service_region, warm_up_count=max_concurrency)
+    synthesis_cache = None
+    if not args.no_cache:
+        synthesis_cache = SynthesisCache(args.cache_directory, max_size_bytes=args.cache_size_mb * 1024 * 1024)
+    batch_partitioner = BatchPartitioner(max_audio_seconds=args.max_batch_seconds) if args.batching == 'packed' else None
+    timing_solver = None
+    if args.prosody_mode == 'solve':
+        timing_solver = TimingSolver(min_rate=args.min_rate, max_rate=args.max_rate, drift_target=args.drift_target, min_fill=args.min_fill)
 
-    ## If command line args are provided, use those instead of the env file. 
-    my_converter.speech_key = speech_key
-    my_converter.service_region = service_region
-    my_converter.voice_name = voice_name
-    my_converter.voice_language = voice_language
+    def configure_converter(converter):
+        ## If command line args are provided, use those instead of the env file. 
+        converter.speech_key = speech_key
+        converter.service_region = service_region
+        converter.voice_name = voice_name
+        converter.voice_language = voice_language
+        converter.quiet = args.quiet
+        converter.metrics = metrics
+        converter.request_scheduler = request_scheduler
+        converter.synthesis_backend = synthesis_backend
+        converter.synthesis_cache = synthesis_cache
+        converter.batch_partitioner = batch_partitioner
 
-    sentences_list = my_converter.combine_ttml_to_sentences()
+    if args.manifest or args.watch or DubbingWorker.is_multi_file_path(input_ttml):
+        ## many files in one process: one warm backend, cache and scheduler for all of them
+        single_file_options = [
+            option for option, value in (
+                ('--target', args.target),
+                ('--pipeline', args.pipeline),
+                ('--previous', args.previous),
+                ('--resume', args.resume),
+                ('--encode-aac', args.encode_aac),
+            ) if value
+        ]
+        if single_file_options:
+            parser.error(f"{', '.join(single_file_options)} can only be used when dubbing a single file, not with a directory, glob pattern, --manifest or --watch")
+        worker = DubbingWorker(
+            configure_converter,
+            output_directory=output_directory,
+            max_jobs=args.max_jobs,
+            voice_name=voice_name,
+            voice_language=voice_language,
+            dub_options={
+                'max_concurrency': max_concurrency,
+                'predictive': args.predictive,
+                'prediction_sample_size': args.prediction_sample_size,
+                'timing_solver': timing_solver,
+                'assembly': args.assembly,
+                'overlap': args.overlap,
+            }
+        )
+        if args.watch:
+            print(f"Watching {args.watch} for TTML files, Ctrl+C to stop")
+            worker_summary = worker.watch(args.watch, poll_interval=args.poll_interval)
+        else:
+            jobs = DubbingWorker.jobs_from_manifest(args.manifest) if args.manifest else DubbingWorker.jobs_from_paths([input_ttml])
+            if not jobs:
+                print(f"No TTML files found for {args.manifest or input_ttml}")
+                raise SystemExit(1)
+            worker_summary = worker.run(jobs)
+        for name, job_summary in worker_summary['jobs'].items():
+            print(f"[{name}] {job_summary['state']} {job_summary.get('error', '')}")
+        with open(os.path.join('outputs', output_directory, 'worker_summary.json'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(worker_summary, indent=4))
+        print(f"{worker_summary['done']} jobs done, {worker_summary['failed']} failed, {worker_summary['skipped']} already done")
+        print(f"Request scheduler: {request_scheduler.stats}")
+        metrics.close()
+        raise SystemExit(1 if worker_summary['failed'] else 0)
 
-    sentences_list = my_converter.pre_process_audio_snippets(
-        sentences_list=sentences_list
-    )
+    ## Create the TTML Converter Object
+    ## a re-dub keeps the output directory, the earlier run's clips may live there
+    my_converter = TTMLConverter(ttml_file_path=input_ttml, output_staging_directory=output_directory, prefix=prefix, resume=args.resume or args.previous is not None)
+    configure_converter(my_converter)
+    if args.resume:
+        print(f"Resuming from job manifest: {my_converter.job_manifest.counts()}")
 
-    ## Get determine the rate to apply to hte voice to most closely match the original. 
-    ## Then Re-preprocess audio snippet but include the average prosody rate
-    adjustments_dict = my_converter.calculate_prosody_rates(sentences_list=sentences_list)
+    targets = [tuple(target.split(':', 1)) for target in args.target]
 
-    avg_prosody_rate = adjustments_dict['avg_prosody']
-    prosody_rates = adjustments_dict['prosody_rates']
+    final_audio_paths = []
+    dead_letters = my_converter.dead_letters
+    if targets:
+        fan_out = MultiTargetDubbing(
+            my_converter,
+            targets,
+            max_concurrency=max_concurrency,
+            predictive=args.predictive,
+            prediction_sample_size=args.prediction_sample_size,
+            assembly=args.assembly,
+            overlap=args.overlap,
+            timing_solver=timing_solver
+        )
+        fan_out_summary = fan_out.run()
+        print(json.dumps(fan_out_summary, indent=4))
+        with open(os.path.join(my_converter.output_staging_directory, 'fan_out_summary.json'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(fan_out_summary, indent=4))
+        final_audio_paths = [locale_summary['output'] for locale_summary in fan_out_summary['targets'].values() if locale_summary['output']]
+        for target_key, locale_summary in fan_out_summary['targets'].items():
+            if 'error' in locale_summary:
+                print(f"Target {target_key} produced no audio: {locale_summary['error']}")
+        dead_letters = fan_out.dead_letters()
+    elif args.pipeline:
+        pipeline = DubbingPipeline(
+            my_converter,
+            max_concurrency=max_concurrency,
+            queue_size=args.pipeline_queue_size,
+            prosody_rate=args.prosody_rate,
+            overlap=args.overlap
+        )
+        final_audio_path = os.path.join(my_converter.output_staging_directory, f"{voice_language}_generated_audio.wav")
+        pipeline_stats = pipeline.run(final_audio_path)
+        print(f"Pipeline finished: {pipeline_stats}")
+        my_converter.output_sentences_list('enriched_sentences.json')
+        if shutil.which('ffmpeg'):
+            AudioStitcher().encode_mp3(final_audio_path, os.path.splitext(final_audio_path)[0] + '.mp3')
+        final_audio_paths = [final_audio_path]
+    elif args.previous:
+        redub_report = my_converter.redub_from_previous(args.previous, max_concurrency=max_concurrency, timing_solver=timing_solver)
+        print(f"Re-dub: {redub_report['reused']} sentences reused, {redub_report['resynthesized']} re-synthesized")
+        my_converter.output_sentences_list('enriched_sentences.json')
+        final_audio_paths = [my_converter.assemble_final_audio(my_converter.sentences_list, assembly=args.assembly, overlap=args.overlap, max_concurrency=max_concurrency)]
+    else:
+        dub_report = my_converter.dub(
+            max_concurrency=max_concurrency,
+            predictive=args.predictive,
+            prediction_sample_size=args.prediction_sample_size,
+            timing_solver=timing_solver,
+            assembly=args.assembly,
+            overlap=args.overlap
+        )
+        if 'timing' in dub_report:
+            print(f"Timing solver re-synthesized {dub_report['timing']['resynthesized']} sentences")
+            for batch_num, batch_report in dub_report['timing']['batches'].items():
+                print(f"Batch {batch_num}: {batch_report}")
+        if 'prediction' in dub_report:
+            print(f"Duration prediction report: {dub_report['prediction']}")
+        final_audio_paths = [dub_report['output']]
 
-    optimized_sentences_list = my_converter.pre_process_audio_snippets(sentences_list, clip_audio_directory='prosody_adjusted', avg_prosody_rate=round(avg_prosody_rate, 1))
+    if args.encode_aac:
+        ## one ffmpeg process per locale; the WAV timelines are encoded without an MP3 generation in between
+        from ttml2speech.LocalEncoder import LocalAacEncoder
+        encode_results = LocalAacEncoder().encode_all(final_audio_paths)
+        for final_audio_path, encode_result in encode_results.items():
+            print(f"AAC encode of {final_audio_path}: {encode_result}")
 
-    ## write out the sentences list to file
-    my_converter.output_sentences_list('enriched_sentences.json')
+    if my_converter.synthesis_cache is not None:
+        cache_stats = my_converter.synthesis_cache.stats()
+        print(f"Synthesis cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
 
-    ## generate the ssml for each the created batches and submit the ssml to the audio for processing
-    ## using the same target file and audio config which should allow us to exceed the 10 minute limit. 
-    sentence_batch_dict = my_converter.break_sentences_into_batches(sentences_list, batch_min_mark=5)
-    speech_synthesizer = my_converter.get_speech_synthesizer(speech_synthesis_output_format='Audio24Khz96KBitRateMonoMp3')
+    print(f"Request scheduler: {my_converter.request_scheduler.stats}")
+    if dead_letters:
+        dead_letters_path = my_converter.output_dead_letters(dead_letters=dead_letters)
+        print(f"{len(dead_letters)} sentences failed to synthesize, see {dead_letters_path}")
 
-    start_file_time = "00:00:00.000"
-    for index, batch in sentence_batch_dict.items():
-        print(f"Generating and submitting SSML for batch {index}")
-        batch_ssml = ""
-        batch_ssml = my_converter.build_ssml(batch, output_file_num=index, file_start=start_file_time)
-        start_file_time = batch[-1]['end']
-        print(start_file_time)
-        res = speech_synthesizer.speak_ssml_async(batch_ssml).get()
-        my_converter.check_speech_result(res, f"SSML for batch {index}")
\ No newline at end of file
+    my_converter.metrics.close()
+    print(f"Run summary: {json.dumps(my_converter.metrics.summary(), indent=4)}")
@@ -0,0 +1,32 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.synthetic_ttml import write_synthetic_ttml
+from ttml2speech.TTMLConverter import TTMLConverter
+
+
+class DubbingTestCase(unittest.TestCase):
+    ## Runs every test in a fresh temporary directory, since converters stage their output under
+    ## ./outputs, with a three minute synthetic TTML to dub.
+    def setUp(self):
+        self.previous_directory = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.ttml_path = os.path.join(self.directory, 'captions.ttml')
+        write_synthetic_ttml(self.ttml_path, duration_minutes=3)
+
+    def tearDown(self):
+        os.chdir(self.previous_directory)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_converter(self, synthesis_backend, output_staging_directory='run', resume=False, request_scheduler=None, synthesis_cache=None):
+        converter = TTMLConverter(ttml_file_path=self.ttml_path, output_staging_directory=output_staging_directory, resume=resume)
+        converter.voice_name = 'en-US-JennyNeural'
+        converter.voice_language = 'en-US'
+        converter.quiet = True
+        converter.synthesis_backend = synthesis_backend
+        converter.request_scheduler = request_scheduler
+        converter.synthesis_cache = synthesis_cache
+        return converter
@@ -0,0 +1,41 @@
+import os
+import unittest
+
+from tests.support import DubbingTestCase
+from ttml2speech.MultiTargetDubbing import MultiTargetDubbing
+from ttml2speech.RequestScheduler import SynthesisError
+from ttml2speech.SpeechBackends import LocalSpeechBackend
+
+
+class BrokenVoiceBackend(LocalSpeechBackend):
+    ## local backend that fails every request for one voice
+    def __init__(self, broken_voice):
+        super().__init__()
+        self.broken_voice = broken_voice
+
+    def synthesize(self, ssml, voice_name, voice_language, output_format):
+        if voice_name == self.broken_voice:
+            raise SynthesisError(f"{voice_name} is unavailable", retryable=False)
+        return super().synthesize(ssml, voice_name, voice_language, output_format)
+
+
+class MultiTargetDubbingTest(DubbingTestCase):
+    def test_failed_target_does_not_stop_the_others(self):
+        converter = self.make_converter(BrokenVoiceBackend('de-DE-Broken'))
+        fan_out = MultiTargetDubbing(converter, [('en-US-JennyNeural', 'en-US'), ('de-DE-Broken', 'de-DE')])
+        targets = fan_out.run()['targets']
+
+        working, broken = targets['en-US-JennyNeural:en-US'], targets['de-DE-Broken:de-DE']
+        self.assertTrue(os.path.exists(working['output']))
+        self.assertEqual(working['failed_sentences'], 0)
+        self.assertIsNone(broken['output'])
+        self.assertIn('unavailable', broken['error'])
+
+        dead_letters = fan_out.dead_letters()
+        self.assertEqual(len(dead_letters), broken['failed_sentences'])
+        self.assertGreater(len(dead_letters), 0)
+        self.assertEqual({dead_letter['target'] for dead_letter in dead_letters}, {'de-DE-Broken:de-DE'})
+
+
+if __name__ == '__main__':
+    unittest.main()
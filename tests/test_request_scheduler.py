@@ -0,0 +1,128 @@
+import random
+import unittest
+
+from tests.support import DubbingTestCase
+from ttml2speech.RequestScheduler import RequestScheduler, SynthesisError, ThrottledError, TokenBucket
+from ttml2speech.SpeechBackends import LocalSpeechBackend
+
+
+class FakeClock:
+    ## time only moves when somebody sleeps, so pacing and backoff can be checked without waiting
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ScriptedService:
+    ## raises the scripted errors in order, then succeeds
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return b'audio'
+
+
+def make_scheduler(clock, **options):
+    return RequestScheduler(rng=random.Random(0), clock=clock.clock, sleep=clock.sleep, **options)
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    def test_token_bucket_paces_requests(self):
+        clock = FakeClock()
+        bucket = TokenBucket(5, clock=clock.clock, sleep=clock.sleep)
+        for _ in range(10):
+            bucket.acquire()
+        ## the first 5 requests use the burst, the next 5 wait 0.2 seconds each
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_throttle_halves_concurrency_and_success_grows_it(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, requests_per_second=1000, max_concurrency=8)
+        service = ScriptedService([ThrottledError("429")])
+        self.assertEqual(scheduler.call(service), b'audio')
+        ## halved on the throttle, then 1 / limit added back by the success
+        self.assertAlmostEqual(scheduler.concurrency_limit, 4.25)
+        self.assertEqual(scheduler.stats, {'calls': 2, 'successes': 1, 'throttles': 1, 'retries': 1, 'failures': 0})
+
+    def test_retries_back_off_with_jitter(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, requests_per_second=1000, max_retries=5, base_delay=0.5, max_delay=3)
+        service = ScriptedService([SynthesisError("boom")] * 5)
+        scheduler.call(service)
+        self.assertEqual(service.calls, 6)
+        for attempt, delay in enumerate(clock.sleeps):
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(3, 0.5 * 2 ** attempt))
+
+    def test_exhausted_retries_raise_the_last_error(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, requests_per_second=1000, max_retries=2)
+        service = ScriptedService([SynthesisError("first"), SynthesisError("second"), SynthesisError("third"), SynthesisError("fourth")])
+        with self.assertRaisesRegex(SynthesisError, "third"):
+            scheduler.call(service)
+        self.assertEqual(service.calls, 3)
+        self.assertEqual(scheduler.stats['failures'], 1)
+
+    def test_non_retryable_errors_are_not_retried(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, requests_per_second=1000)
+        service = ScriptedService([SynthesisError("bad credentials", retryable=False)])
+        with self.assertRaises(SynthesisError):
+            scheduler.call(service)
+        self.assertEqual(service.calls, 1)
+
+    def test_finished_jobs_are_forgotten(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, requests_per_second=1000)
+        for job in ('first', 'second'):
+            scheduler.call(ScriptedService(), job=job)
+        self.assertEqual(scheduler.job_in_flight, {})
+        self.assertEqual(scheduler.job_waiting, {})
+
+
+class ScheduledDubbingTest(DubbingTestCase):
+    def test_injected_throttles_and_failures_are_retried(self):
+        clock = FakeClock()
+        backend = LocalSpeechBackend(throttle_rate=0.3, error_rate=0.1, seed=3)
+        scheduler = make_scheduler(clock, requests_per_second=20, max_concurrency=4, max_retries=20)
+        converter = self.make_converter(backend, request_scheduler=scheduler)
+        sentences_list = converter.pre_process_audio_snippets(converter.combine_ttml_to_sentences())
+
+        self.assertEqual(converter.dead_letters, [])
+        self.assertGreater(scheduler.stats['throttles'], 0)
+        self.assertEqual(scheduler.stats['successes'], len(sentences_list))
+        self.assertEqual(scheduler.stats['calls'], backend.calls)
+        self.assertEqual(scheduler.stats['calls'], scheduler.stats['successes'] + scheduler.stats['retries'])
+        for sentence in sentences_list:
+            self.assertGreater(sentence['actual_duration'], 0)
+
+    def test_sentences_that_keep_failing_are_dead_lettered(self):
+        clock = FakeClock()
+        backend = LocalSpeechBackend(error_rate=1.0)
+        scheduler = make_scheduler(clock, requests_per_second=20, max_retries=2)
+        converter = self.make_converter(backend, request_scheduler=scheduler)
+        sentences_list = converter.pre_process_audio_snippets(converter.combine_ttml_to_sentences())
+
+        self.assertEqual(len(converter.dead_letters), len(sentences_list))
+        self.assertEqual(backend.calls, 3 * len(sentences_list))
+        self.assertEqual(converter.job_manifest.counts(), {'failed': len(sentences_list)})
+        for sentence in sentences_list:
+            ## no empty WAV with a zero duration is left behind
+            self.assertTrue(sentence['synthesis_failed'])
+            self.assertIsNone(sentence['audio_file'])
+            self.assertIsNone(sentence['actual_duration'])
+
+
+if __name__ == '__main__':
+    unittest.main()
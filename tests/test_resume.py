@@ -0,0 +1,74 @@
+import unittest
+
+from tests.support import DubbingTestCase
+from ttml2speech.SpeechBackends import LocalSpeechBackend
+
+
+class Killed(BaseException):
+    ## the process dying mid run; not an Exception, so nothing on the way up handles it
+    pass
+
+
+class KillingBackend(LocalSpeechBackend):
+    ## local backend that dies once kill_after requests have completed
+    def __init__(self, kill_after=None):
+        super().__init__()
+        self.kill_after = kill_after
+        self.completed = 0
+
+    def synthesize(self, ssml, voice_name, voice_language, output_format):
+        with self._lock:
+            if self.kill_after is not None and self.completed >= self.kill_after:
+                raise Killed()
+        audio_data = super().synthesize(ssml, voice_name, voice_language, output_format)
+        with self._lock:
+            self.completed += 1
+        return audio_data
+
+
+class ResumeTest(DubbingTestCase):
+    def kill_midway(self, kill_after, max_concurrency):
+        converter = self.make_converter(KillingBackend(kill_after=kill_after))
+        with self.assertRaises(Killed):
+            converter.pre_process_audio_snippets(converter.combine_ttml_to_sentences(), max_concurrency=max_concurrency)
+        return converter
+
+    def resume(self, max_concurrency=1):
+        backend = KillingBackend()
+        converter = self.make_converter(backend, resume=True)
+        sentences_list = converter.pre_process_audio_snippets(converter.combine_ttml_to_sentences(), max_concurrency=max_concurrency)
+        return converter, backend, sentences_list
+
+    def test_resumed_run_makes_exactly_the_remaining_calls(self):
+        killed = self.kill_midway(kill_after=5, max_concurrency=1)
+        self.assertEqual(killed.job_manifest.counts(), {'done': 5})
+
+        converter, backend, sentences_list = self.resume()
+        self.assertGreater(len(sentences_list), 5)
+        self.assertEqual(backend.calls, len(sentences_list) - 5)
+        self.assertEqual(converter.job_manifest.counts(), {'done': len(sentences_list)})
+        for sentence in sentences_list:
+            self.assertGreater(sentence['actual_duration'], 0)
+
+    def test_concurrent_run_resumes_from_what_the_manifest_recorded(self):
+        killed = self.kill_midway(kill_after=9, max_concurrency=4)
+        done = killed.job_manifest.counts()['done']
+
+        _, backend, sentences_list = self.resume(max_concurrency=4)
+        self.assertEqual(backend.calls, len(sentences_list) - done)
+
+    def test_finished_run_resumes_without_calls(self):
+        self.resume()
+        _, backend, _ = self.resume()
+        self.assertEqual(backend.calls, 0)
+
+    def test_run_without_resume_starts_over(self):
+        self.kill_midway(kill_after=5, max_concurrency=1)
+        backend = KillingBackend()
+        converter = self.make_converter(backend)
+        sentences_list = converter.pre_process_audio_snippets(converter.combine_ttml_to_sentences())
+        self.assertEqual(backend.calls, len(sentences_list))
+
+
+if __name__ == '__main__':
+    unittest.main()
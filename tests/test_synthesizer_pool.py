@@ -0,0 +1,121 @@
+import os
+import threading
+import unittest
+
+from azure.cognitiveservices.speech import ResultReason
+
+from tests.support import DubbingTestCase
+from ttml2speech.SpeechBackends import AzureSpeechBackend, LocalSpeechBackend
+from ttml2speech.SynthesisCache import SynthesisCache
+from ttml2speech.SynthesizerPool import SynthesizerPool
+
+
+class FakeResult:
+    def __init__(self, audio_data):
+        self.reason = ResultReason.SynthesizingAudioCompleted
+        self.audio_data = audio_data
+        self.cancellation_details = None
+
+
+class FakeFuture:
+    def __init__(self, result):
+        self.result = result
+
+    def get(self):
+        return self.result
+
+
+class FakeSynthesizer:
+    ## stands in for SpeechSynthesizer; the audio comes from the local backend
+    renderer = LocalSpeechBackend()
+
+    def __init__(self, voice_name, voice_language, output_format):
+        self.key = (voice_name, voice_language, output_format)
+
+    def speak_ssml_async(self, ssml):
+        return FakeFuture(FakeResult(self.renderer.synthesize(ssml, *self.key)))
+
+
+class FakeSpeechService:
+    ## counts synthesizer constructions and connection opens
+    def __init__(self):
+        self.constructions = 0
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+    def create_synthesizer(self, voice_name, voice_language, output_format):
+        with self._lock:
+            self.constructions += 1
+        return FakeSynthesizer(voice_name, voice_language, output_format)
+
+    def open_connection(self, synthesizer):
+        with self._lock:
+            self.connections_opened += 1
+        return object()
+
+    def backend(self, warm_up_count=1):
+        pool = SynthesizerPool('key', 'region', synthesizer_factory=self.create_synthesizer, connection_opener=self.open_connection)
+        return AzureSpeechBackend('key', 'region', synthesizer_pool=pool, warm_up_count=warm_up_count)
+
+
+class SynthesizerPoolTest(DubbingTestCase):
+    def test_sentences_reuse_warm_synthesizers(self):
+        service = FakeSpeechService()
+        converter = self.make_converter(service.backend(warm_up_count=4))
+        sentences_list = converter.combine_ttml_to_sentences()
+        converter.pre_process_audio_snippets(sentences_list, max_concurrency=4)
+
+        self.assertGreater(len(sentences_list), 4)
+        ## one synthesizer and connection per worker, not per sentence
+        self.assertEqual(service.constructions, 4)
+        self.assertEqual(service.connections_opened, 4)
+        for sentence in sentences_list:
+            self.assertTrue(os.path.exists(sentence['audio_file']))
+            self.assertGreater(sentence['actual_duration'], 0)
+
+    def test_synthesizers_are_reused_across_passes(self):
+        service = FakeSpeechService()
+        converter = self.make_converter(service.backend())
+        sentences_list = converter.combine_ttml_to_sentences()
+        converter.pre_process_audio_snippets(sentences_list)
+        converter.pre_process_audio_snippets(sentences_list, clip_audio_directory='prosody_adjusted', avg_prosody_rate=0.9)
+
+        self.assertEqual(service.constructions, 1)
+        self.assertEqual(service.connections_opened, 1)
+
+    def test_cached_run_opens_no_connections(self):
+        cache = SynthesisCache(os.path.join(self.directory, 'cache'))
+        first = self.make_converter(FakeSpeechService().backend(), output_staging_directory='first', synthesis_cache=cache)
+        first.pre_process_audio_snippets(first.combine_ttml_to_sentences(), max_concurrency=2)
+
+        service = FakeSpeechService()
+        backend = service.backend(warm_up_count=2)
+        second = self.make_converter(backend, output_staging_directory='second', synthesis_cache=cache)
+        second.pre_process_audio_snippets(second.combine_ttml_to_sentences(), max_concurrency=2)
+
+        self.assertEqual(service.constructions, 0)
+        self.assertEqual(service.connections_opened, 0)
+        backend.close()
+
+    def test_cache_is_not_shared_between_backends(self):
+        cache = SynthesisCache(os.path.join(self.directory, 'cache'))
+        local = self.make_converter(LocalSpeechBackend(), output_staging_directory='local', synthesis_cache=cache)
+        local.pre_process_audio_snippets(local.combine_ttml_to_sentences())
+
+        service = FakeSpeechService()
+        azure = self.make_converter(service.backend(), output_staging_directory='azure', synthesis_cache=cache)
+        sentences_list = azure.pre_process_audio_snippets(azure.combine_ttml_to_sentences())
+
+        ## the local stand-in's tones are never served as Azure speech
+        self.assertEqual(cache.stats()['hits'], 0)
+        self.assertEqual(cache.stats()['misses'], 2 * len(sentences_list))
+        self.assertEqual(service.constructions, 1)
+
+    def test_backend_creates_no_pool_until_used(self):
+        backend = AzureSpeechBackend('key', 'region')
+        backend.close()
+        self.assertIsNone(backend.synthesizer_pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
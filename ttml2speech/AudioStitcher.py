@@ -0,0 +1,196 @@
+import os
+import mmap
+import shutil
+import struct
+import subprocess
+
+from ttml2speech.TTMLParser import parse_time_expression
+from ttml2speech.SentenceTable import timestamp_seconds
+
+
+def find_wav_data(buffer):
+    ## Walk the RIFF chunks and return (fmt, data_offset, data_length).
+    ## Works on an mmap so the sample data itself is never copied.
+    if buffer[0:4] != b'RIFF' or buffer[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(buffer):
+        chunk_id = buffer[offset:offset + 4]
+        chunk_size = struct.unpack('<I', buffer[offset + 4:offset + 8])[0]
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', buffer[body:body + 16])
+            fmt = (channels, sample_rate, bits // 8, block_align)
+        elif chunk_id == b'data':
+            ## some writers leave the size unset when streaming, so clamp to the file length
+            return fmt, body, min(chunk_size, len(buffer) - body)
+        offset = body + chunk_size + (chunk_size & 1)
+    raise ValueError("No data chunk found in WAV file")
+
+
+def wav_header(channels, sample_rate, sample_width, data_length):
+    block_align = channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_length, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8,
+        b'data', data_length
+    )
+
+
+class AudioStitcher:
+    ## Assembles the per-sentence WAV clips into one timeline offline, placing each clip at its
+    ## TTML begin offset with silence in between. Replaces the final SSML-with-breaks synthesis.
+    ## overlap='shift' pushes a clip later when the previous one is still playing,
+    ## overlap='truncate' cuts the previous clip off where the next one begins.
+    def __init__(self, overlap='shift', file_start="00:00:00.000"):
+        if overlap not in ('shift', 'truncate'):
+            raise ValueError(f"Unknown overlap policy: {overlap}")
+        self.overlap = overlap
+        self.file_start = file_start
+        self.file_start_seconds = parse_time_expression(file_start)
+
+    def plan(self, sentences_list):
+        ## Returns the placements (sentence index, start frame, frame count) and the clip format,
+        ## reading only the WAV headers.
+        clip_format = None
+        placements = []
+        cursor = 0
+        for i, sentence in enumerate(sentences_list):
+            if not sentence.get('audio_file') or not os.path.exists(sentence['audio_file']):
+                continue
+            with open(sentence['audio_file'], 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as clip:
+                    fmt, _, data_length = find_wav_data(clip)
+            if clip_format is None:
+                clip_format = fmt
+            elif fmt != clip_format:
+                raise ValueError(f"{sentence['audio_file']} does not match the format of the other clips")
+
+            channels, sample_rate, sample_width, block_align = fmt
+            frames = data_length // block_align
+            start = int(round((timestamp_seconds(sentence, 'begin') - self.file_start_seconds) * sample_rate))
+            if placements and start < cursor:
+                if self.overlap == 'shift':
+                    start = cursor
+                else:
+                    previous_index, previous_start, _ = placements[-1]
+                    start = max(start, previous_start)
+                    placements[-1] = (previous_index, previous_start, start - previous_start)
+            placements.append((i, start, frames))
+            cursor = start + frames
+        return placements, clip_format
+
+    def assemble(self, sentences_list, output_path):
+        placements, clip_format = self.plan(sentences_list)
+        if clip_format is None:
+            raise ValueError("There are no synthesized clips to assemble")
+        channels, sample_rate, sample_width, block_align = clip_format
+        total_frames = max(start + frames for _, start, frames in placements)
+        data_length = total_frames * block_align
+        header = wav_header(channels, sample_rate, sample_width, data_length)
+
+        ## Preallocate the whole output file: the sparse zero fill is the silence between clips.
+        ## Clip samples are then copied straight from the mapped source into the mapped output.
+        with open(output_path, 'wb+') as out:
+            out.write(header)
+            out.truncate(len(header) + data_length)
+            with mmap.mmap(out.fileno(), 0) as timeline:
+                for i, start, frames in placements:
+                    with open(sentences_list[i]['audio_file'], 'rb') as f:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as clip:
+                            _, data_offset, _ = find_wav_data(clip)
+                            begin = len(header) + start * block_align
+                            length = frames * block_align
+                            source = memoryview(clip)
+                            try:
+                                timeline[begin:begin + length] = source[data_offset:data_offset + length]
+                            finally:
+                                source.release()
+                timeline.flush()
+
+        for i, start, _ in placements:
+            sentences_list[i]['placed_begin'] = start / sample_rate
+        return total_frames / sample_rate
+
+    def encode_mp3(self, wav_path, output_path, bitrate='96k'):
+        ## MP3 encoding is delegated to ffmpeg, which streams the WAV timeline from disk
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg is required to encode the stitched timeline to MP3")
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-i', wav_path, '-b:a', bitrate, output_path], check=True)
+        return output_path
+
+
+class TimelineWriter:
+    ## Streaming counterpart of AudioStitcher for when clips arrive one at a time in sentence order.
+    ## Only the most recent clip is held back (so 'truncate' can cut it at the next begin offset);
+    ## everything before it is already on disk, so memory use does not grow with the timeline.
+    silence_chunk_frames = 16000
+
+    def __init__(self, output_path, overlap='shift'):
+        if overlap not in ('shift', 'truncate'):
+            raise ValueError(f"Unknown overlap policy: {overlap}")
+        self.output_path = output_path
+        self.overlap = overlap
+        self.clip_format = None
+        self.frames_written = 0
+        self.pending = None
+        self._file = open(output_path, 'wb')
+
+    def add_clip(self, begin_seconds, clip_path):
+        with open(clip_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as clip:
+                fmt, _, data_length = find_wav_data(clip)
+        if self.clip_format is None:
+            self.clip_format = fmt
+            ## placeholder header, the sizes are filled in by close()
+            self._file.write(wav_header(fmt[0], fmt[1], fmt[2], 0))
+        elif fmt != self.clip_format:
+            raise ValueError(f"{clip_path} does not match the format of the other clips")
+
+        channels, sample_rate, sample_width, block_align = fmt
+        start = max(int(round(begin_seconds * sample_rate)), self.frames_written)
+        frames = data_length // block_align
+        if self.pending is not None:
+            pending_start, pending_path, pending_frames = self.pending
+            if start < pending_start + pending_frames:
+                if self.overlap == 'shift':
+                    start = pending_start + pending_frames
+                else:
+                    start = max(start, pending_start)
+                    self.pending = (pending_start, pending_path, start - pending_start)
+            self._write_pending()
+        self.pending = (start, clip_path, frames)
+        return start / sample_rate
+
+    def _write_pending(self):
+        start, clip_path, frames = self.pending
+        self.pending = None
+        block_align = self.clip_format[3]
+        while self.frames_written < start:
+            silence = min(self.silence_chunk_frames, start - self.frames_written)
+            self._file.write(bytes(silence * block_align))
+            self.frames_written += silence
+        with open(clip_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as clip:
+                _, data_offset, _ = find_wav_data(clip)
+                source = memoryview(clip)
+                try:
+                    self._file.write(source[data_offset:data_offset + frames * block_align])
+                finally:
+                    source.release()
+        self.frames_written += frames
+
+    def close(self):
+        if self.pending is not None:
+            self._write_pending()
+        if self.clip_format is not None:
+            channels, sample_rate, sample_width, block_align = self.clip_format
+            self._file.seek(0)
+            self._file.write(wav_header(channels, sample_rate, sample_width, self.frames_written * block_align))
+        self._file.close()
+        if self.clip_format is None:
+            return 0.0
+        return self.frames_written / self.clip_format[1]
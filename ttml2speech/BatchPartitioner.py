@@ -0,0 +1,67 @@
+from ttml2speech.SentenceTable import SentenceTable
+
+
+class BatchPartitioner:
+    ## Packs sentences into final synthesis batches by predicted audio length and SSML size instead
+    ## of clock minutes. A batch is closed before it would exceed max_audio_seconds (one synthesis
+    ## request is capped at 10 minutes of audio) or max_ssml_characters. The cut is made at the
+    ## longest pause after the batch is min_fill full, so boundaries fall in silence.
+    ## Returns {batch number: [sentences]} like TTMLConverter.break_sentences_into_batches.
+    ssml_header_characters = 250
+    sentence_overhead_characters = 40
+    break_characters = 25
+    max_break_seconds = 5
+
+    def __init__(self, max_audio_seconds=540, max_ssml_characters=40000, min_fill=0.6):
+        self.max_audio_seconds = max_audio_seconds
+        self.max_ssml_characters = max_ssml_characters
+        self.min_fill = min_fill
+
+    def sentence_cost(self, sentence, gap):
+        ## (pause before the sentence, predicted audio seconds including that pause, SSML characters)
+        pause = max(0.0, gap)
+        actual_duration = sentence.get('actual_duration')
+        spoken = max(sentence['target_duration'], actual_duration if actual_duration is not None else 0)
+        audio_seconds = pause + spoken
+        ## silence is written as a run of breaks of at most max_break_seconds each
+        breaks = int(audio_seconds // self.max_break_seconds) + 1
+        ssml_characters = len(sentence['text']) + self.sentence_overhead_characters + breaks * self.break_characters
+        return pause, audio_seconds, ssml_characters
+
+    def over_limit(self, audio_seconds, ssml_characters):
+        return audio_seconds > self.max_audio_seconds or ssml_characters + self.ssml_header_characters > self.max_ssml_characters
+
+    def split_point(self, pending, next_pause):
+        ## the batch becomes pending[:cut]; choose the longest pause once the batch is min_fill full
+        best_cut = len(pending)
+        best_pause = -1.0
+        audio_seconds = 0.0
+        ssml_characters = 0
+        for cut in range(1, len(pending) + 1):
+            audio_seconds += pending[cut - 1][2]
+            ssml_characters += pending[cut - 1][3]
+            if audio_seconds < self.min_fill * self.max_audio_seconds and ssml_characters < self.min_fill * self.max_ssml_characters:
+                continue
+            pause = pending[cut][1] if cut < len(pending) else next_pause
+            if pause >= best_pause:
+                best_cut = cut
+                best_pause = pause
+        return best_cut
+
+    def partition(self, sentences_list):
+        batches = []
+        pending = []
+        gaps = SentenceTable.from_sentences(sentences_list).gaps().tolist()
+        for sentence, gap in zip(sentences_list, gaps):
+            pause, audio_seconds, ssml_characters = self.sentence_cost(sentence, gap)
+            while pending and self.over_limit(
+                sum(p[2] for p in pending) + audio_seconds,
+                sum(p[3] for p in pending) + ssml_characters
+            ):
+                cut = self.split_point(pending, pause)
+                batches.append([p[0] for p in pending[:cut]])
+                pending = pending[cut:]
+            pending.append((sentence, pause, audio_seconds, ssml_characters))
+        if pending:
+            batches.append([p[0] for p in pending])
+        return dict(enumerate(batches))
@@ -0,0 +1,121 @@
+import os
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UploadVerificationError(Exception):
+    pass
+
+
+class BlockBlobUploader:
+    ## Uploads files as block blobs: every file is split into block_size blocks, the blocks of all
+    ## files are staged in parallel on one pool of max_concurrency workers, and each file's block
+    ## list is committed once its blocks are in. Block ids carry the block's index and MD5, so an
+    ## interrupted upload is resumed by staging only the blocks the service doesn't already have,
+    ## and a blob that is already committed with the same blocks is skipped. Each block is sent
+    ## with a transactional MD5 (validate_content) and the committed block list is checked
+    ## against the file afterwards. blob_service_client can point at Azurite for local testing.
+    def __init__(self, blob_service_client, block_size=4 * 1024 * 1024, max_concurrency=8):
+        self.blob_service_client = blob_service_client
+        self.block_size = block_size
+        self.max_concurrency = max(1, max_concurrency)
+        self.stats = {'files': 0, 'files_skipped': 0, 'blocks_staged': 0, 'blocks_reused': 0, 'bytes_staged': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def block_id(index, block_md5):
+        ## all ids of a blob must have the same length
+        return base64.b64encode(f"{index:06d}-{block_md5}".encode('ascii')).decode('ascii')
+
+    def plan(self, path):
+        ## (block id, offset, length) for every block, plus the MD5 of the whole file
+        blocks = []
+        file_md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            offset = 0
+            index = 0
+            while True:
+                data = f.read(self.block_size)
+                if not data:
+                    break
+                file_md5.update(data)
+                blocks.append((self.block_id(index, hashlib.md5(data).hexdigest()), offset, len(data)))
+                offset += len(data)
+                index += 1
+        return blocks, file_md5.digest()
+
+    @staticmethod
+    def existing_blocks(blob_client):
+        ## committed and uncommitted block ids the service already has for this blob
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            committed, uncommitted = blob_client.get_block_list('all')
+        except ResourceNotFoundError:
+            return [], set()
+        return [block.id for block in committed], {block.id for block in committed + uncommitted}
+
+    def stage_block(self, blob_client, path, block_id, offset, length):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        blob_client.stage_block(block_id, data, length=length, validate_content=True)
+        with self._lock:
+            self.stats['blocks_staged'] += 1
+            self.stats['bytes_staged'] += length
+
+    def commit(self, blob_client, blocks, file_md5):
+        from azure.storage.blob import BlobBlock, ContentSettings
+        block_ids = [block_id for block_id, _, _ in blocks]
+        blob_client.commit_block_list(
+            [BlobBlock(block_id=block_id) for block_id in block_ids],
+            content_settings=ContentSettings(content_md5=bytearray(file_md5))
+        )
+        committed, _ = self.existing_blocks(blob_client)
+        if committed != block_ids:
+            raise UploadVerificationError(f"Committed block list of {blob_client.blob_name} does not match the local file")
+
+    def upload(self, uploads):
+        ## uploads is a list of (container, blob_name, path); returns {blob_name: url}
+        files = []
+        for container, blob_name, path in uploads:
+            blob_client = self.blob_service_client.get_blob_client(container, blob_name)
+            blocks, file_md5 = self.plan(path)
+            committed, existing = self.existing_blocks(blob_client)
+            files.append((blob_client, path, blocks, file_md5, committed, existing))
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = []
+            for blob_client, path, blocks, file_md5, committed, existing in files:
+                if committed == [block_id for block_id, _, _ in blocks]:
+                    continue
+                for block_id, offset, length in blocks:
+                    if block_id in existing:
+                        self.stats['blocks_reused'] += 1
+                        continue
+                    futures.append(executor.submit(self.stage_block, blob_client, path, block_id, offset, length))
+            for future in futures:
+                future.result()
+
+        urls = {}
+        for blob_client, path, blocks, file_md5, committed, existing in files:
+            self.stats['files'] += 1
+            if committed == [block_id for block_id, _, _ in blocks]:
+                self.stats['files_skipped'] += 1
+            else:
+                self.commit(blob_client, blocks, file_md5)
+            urls[blob_client.blob_name] = blob_client.url
+        return urls
+
+
+def blob_service_client_from_environment(connection_string=None):
+    ## a connection string (e.g. "UseDevelopmentStorage=true" for Azurite) wins over endpoint + key
+    from azure.storage.blob import BlobServiceClient
+    connection_string = connection_string or os.environ.get('STORAGEACCOUNTCONNECTION')
+    if connection_string:
+        return BlobServiceClient.from_connection_string(connection_string)
+    return BlobServiceClient(
+        account_url=os.environ['STORAGE_ACCOUNT_BLOB_ENDPOINT'],
+        credential=os.environ['STORAGE_ACCOUNT_KEY']
+    )
@@ -0,0 +1,119 @@
+import os
+import time
+import queue
+import threading
+
+from ttml2speech.AudioStitcher import TimelineWriter
+from ttml2speech.SentenceTable import timestamp_seconds
+
+
+class DubbingPipeline:
+    ## Staged producer/consumer run of parse -> synthesize -> measure -> assemble.
+    ## The TTML is parsed on its own thread, sentences are synthesized by a pool of workers as soon
+    ## as they are complete, and the assembler streams clips into the timeline in sentence order.
+    ## At most queue_size + max_concurrency sentences are between parsing and assembly at any time,
+    ## so time-to-first-clip and peak memory don't depend on transcript length.
+    ## Because the averaged prosody rate is only known once every sentence has been measured,
+    ## the pipeline synthesizes in a single pass at a fixed prosody_rate.
+    def __init__(self, converter, max_concurrency=4, queue_size=16, clip_audio_directory="pipeline", prosody_rate=1, overlap='shift'):
+        self.converter = converter
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_size = max(1, queue_size)
+        self.clip_audio_directory = clip_audio_directory
+        self.prosody_rate = prosody_rate
+        self.overlap = overlap
+        self.sentences_list = []
+
+    def _parse(self, sentence_queue, results_queue, slots, stop):
+        try:
+            for i, sentence in enumerate(self.converter.iter_ttml_sentences()):
+                ## wait for a free slot so parsing never runs too far ahead of assembly
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                sentence['parsed_at'] = time.perf_counter()
+                sentence_queue.put((i, sentence))
+        except Exception as e:
+            results_queue.put(('error', None, e))
+        finally:
+            for _ in range(self.max_concurrency):
+                sentence_queue.put(None)
+
+    def _synthesize(self, sentence_queue, results_queue, folder_path, stop):
+        while True:
+            item = sentence_queue.get()
+            if item is None:
+                results_queue.put(('finished', None, None))
+                return
+            if stop.is_set():
+                continue
+            i, sentence = item
+            try:
+                self.converter.synthesize_sentence(sentence, i, folder_path, self.prosody_rate)
+                results_queue.put(('done', i, sentence))
+            except Exception as e:
+                results_queue.put(('error', i, e))
+
+    def run(self, output_path):
+        folder_path = os.path.join(self.converter.output_staging_directory, self.clip_audio_directory)
+        os.makedirs(folder_path, exist_ok=True)
+
+        sentence_queue = queue.Queue()
+        results_queue = queue.Queue()
+        slots = threading.Semaphore(self.queue_size + self.max_concurrency)
+        stop = threading.Event()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._parse, args=(sentence_queue, results_queue, slots, stop), daemon=True)]
+        for _ in range(self.max_concurrency):
+            threads.append(threading.Thread(target=self._synthesize, args=(sentence_queue, results_queue, folder_path, stop), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        ## assemble on this thread, reordering completed sentences back into caption order
+        writer = TimelineWriter(output_path, overlap=self.overlap)
+        self.sentences_list = []
+        completed = {}
+        next_index = 0
+        finished_workers = 0
+        first_clip_seconds = None
+        clip_latencies = []
+        error = None
+        try:
+            while finished_workers < self.max_concurrency:
+                kind, i, payload = results_queue.get()
+                if kind == 'finished':
+                    finished_workers += 1
+                    continue
+                if kind == 'error':
+                    stop.set()
+                    error = error or payload
+                    continue
+                completed[i] = payload
+                while next_index in completed:
+                    sentence = completed.pop(next_index)
+                    if sentence.get('audio_file'):
+                        sentence['placed_begin'] = writer.add_clip(timestamp_seconds(sentence, 'begin'), sentence['audio_file'])
+                    clip_latencies.append(time.perf_counter() - sentence.pop('parsed_at'))
+                    if first_clip_seconds is None:
+                        first_clip_seconds = time.perf_counter() - started
+                    self.sentences_list.append(sentence)
+                    slots.release()
+                    next_index += 1
+        finally:
+            timeline_duration = writer.close()
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        if error is not None:
+            raise error
+
+        self.converter.sentences_list = self.sentences_list
+        return {
+            'sentences': len(self.sentences_list),
+            'timeline_duration': timeline_duration,
+            'time_to_first_clip': first_clip_seconds,
+            'total_seconds': time.perf_counter() - started,
+            'max_clip_latency': max(clip_latencies) if clip_latencies else None,
+        }
@@ -0,0 +1,221 @@
+import os
+import glob
+import json
+import time
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ttml2speech.TTMLConverter import TTMLConverter
+from ttml2speech.JobManifest import JobManifest
+
+
+class DubbingWorker:
+    ## Dubs many TTML files in one process: a list of files, a manifest of jobs, or a drop folder
+    ## watched for new files. configure_converter is called on every job's converter to attach the
+    ## shared synthesis backend, cache, scheduler and metrics, so connections and startup are paid
+    ## once. Each job's requests are tagged with its name so the shared RequestScheduler hands out
+    ## slots fairly between jobs. A failing job is recorded and does not stop the others, and a file
+    ## the worker manifest already has done with the same size and mtime is skipped. Only the last
+    ## max_history finished jobs are kept for the summary, so a long running worker stays bounded.
+    def __init__(self, configure_converter, output_directory='jobs', max_jobs=4, dub_options=None, progress_interval=10, max_history=1000, voice_name=None, voice_language=None):
+        self.configure_converter = configure_converter
+        ## the voice and language of jobs that don't name their own
+        self.voice_name = voice_name
+        self.voice_language = voice_language
+        self.output_directory = output_directory
+        self.max_jobs = max(1, max_jobs)
+        self.dub_options = dub_options or {}
+        self.progress_interval = progress_interval
+        self.max_history = max_history
+        self.jobs = {}
+        self.finished = deque()
+        self.totals = {'done': 0, 'failed': 0, 'skipped': 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join('outputs', output_directory), exist_ok=True)
+        self.worker_manifest = JobManifest(os.path.join('outputs', output_directory, 'worker_manifest.jsonl'))
+
+    @staticmethod
+    def is_multi_file_path(path):
+        ## a directory or a glob pattern, as opposed to a single TTML file
+        return os.path.isdir(path) or glob.has_magic(path)
+
+    @staticmethod
+    def jobs_from_paths(paths):
+        ## files, directories (every *.ttml inside) and glob patterns; a missing file is an error
+        infiles = []
+        for path in paths:
+            if os.path.isdir(path):
+                infiles.extend(sorted(glob.glob(os.path.join(path, '*.ttml'))))
+            elif glob.has_magic(path):
+                infiles.extend(sorted(glob.glob(path)))
+            elif os.path.exists(path):
+                infiles.append(path)
+            else:
+                raise FileNotFoundError(path)
+        return [{'infile': infile} for infile in infiles]
+
+    @staticmethod
+    def jobs_from_manifest(manifest_path):
+        ## a JSON list, or JSON lines, of {"infile": ..., "voice": ..., "language": ..., "name": ...}
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        if text.lstrip().startswith('['):
+            return json.loads(text)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def job_name(self, job):
+        name = job.get('name') or os.path.splitext(os.path.basename(job['infile']))[0]
+        with self._lock:
+            unique_name = name
+            suffix = 2
+            while unique_name in self.jobs:
+                unique_name = f"{name}_{suffix}"
+                suffix += 1
+            self.jobs[unique_name] = {'infile': job['infile'], 'state': 'queued'}
+        return unique_name
+
+    def job_key(self, job):
+        ## the worker manifest records a job per file, job name, voice and language, so dubbing the same
+        ## TTML into another voice or locale is a job of its own
+        name = job.get('name') or os.path.splitext(os.path.basename(job['infile']))[0]
+        return f"{job['infile']}|{name}|{job.get('voice') or self.voice_name}|{job.get('language') or self.voice_language}"
+
+    @staticmethod
+    def file_signature(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def already_done(self, job):
+        try:
+            signature = self.file_signature(job['infile'])
+        except FileNotFoundError:
+            ## let run_job record the failure
+            return False
+        return self.worker_manifest.completed('job', self.job_key(job), signature) is not None
+
+    def skip_job(self, name):
+        print(f"[{name}] already done, skipping")
+        self.jobs[name]['state'] = 'skipped'
+        self.job_finished(name, 'skipped')
+
+    def job_finished(self, name, state):
+        with self._lock:
+            self.totals[state] += 1
+            self.finished.append(name)
+            while len(self.finished) > self.max_history:
+                self.jobs.pop(self.finished.popleft(), None)
+
+    def run_job(self, job, name):
+        status = self.jobs[name]
+        status['state'] = 'running'
+        status['started'] = time.time()
+        signature = None
+        try:
+            signature = self.file_signature(job['infile'])
+            converter = TTMLConverter(ttml_file_path=job['infile'], output_staging_directory=os.path.join(self.output_directory, name), prefix=name)
+            self.configure_converter(converter)
+            converter.job_name = name
+            converter.voice_name = job.get('voice') or converter.voice_name
+            converter.voice_language = job.get('language') or converter.voice_language
+            status['converter'] = converter
+            status['report'] = converter.dub(**self.dub_options)
+            if converter.dead_letters:
+                converter.output_dead_letters()
+            status['state'] = 'done'
+            self.worker_manifest.record('job', self.job_key(job), 'done', ssml_hash=signature, audio_file=status['report']['output'])
+        except Exception as e:
+            status['state'] = 'failed'
+            status['error'] = str(e)
+            status['traceback'] = traceback.format_exc()
+            self.worker_manifest.record('job', self.job_key(job), 'failed', ssml_hash=signature, error=str(e))
+        finally:
+            status['seconds'] = time.time() - status['started']
+            ## the converter holds the whole sentences_list, don't keep it once the job is over
+            status.pop('converter', None)
+            self.job_finished(name, status['state'])
+        return status
+
+    def progress(self):
+        ## per job state, and for running jobs how many sentence syntheses the job manifest has recorded
+        progress = {}
+        for name, status in list(self.jobs.items()):
+            job_progress = {'state': status['state']}
+            converter = status.get('converter')
+            if converter is not None and status['state'] == 'running':
+                job_progress['sentences'] = len(getattr(converter, 'sentences_list', []))
+                job_progress['syntheses'] = converter.job_manifest.counts()
+            progress[name] = job_progress
+        return progress
+
+    def _report_progress(self, stop):
+        while not stop.wait(self.progress_interval):
+            for name, job_progress in self.progress().items():
+                if job_progress['state'] == 'running':
+                    print(f"[{name}] {job_progress}")
+
+    def summary(self):
+        jobs = {}
+        with self._lock:
+            for name, status in list(self.jobs.items()):
+                jobs[name] = {key: value for key, value in status.items() if key not in ('converter', 'started')}
+            return {'jobs': jobs, **self.totals}
+
+    def run(self, jobs):
+        stop = threading.Event()
+        reporter = threading.Thread(target=self._report_progress, args=(stop,), daemon=True)
+        reporter.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+                futures = []
+                for job in jobs:
+                    name = self.job_name(job)
+                    if self.already_done(job):
+                        self.skip_job(name)
+                        continue
+                    futures.append(executor.submit(self.run_job, job, name))
+                for future in futures:
+                    future.result()
+        finally:
+            stop.set()
+        return self.summary()
+
+    def watch(self, directory, pattern='*.ttml', poll_interval=5, max_polls=None):
+        ## Long running worker: dub every file that appears in directory. A file is picked up once
+        ## its size and modification time stop changing between two polls (it is fully copied in),
+        ## and skipped if the worker manifest already has it done with the same signature.
+        stop = threading.Event()
+        reporter = threading.Thread(target=self._report_progress, args=(stop,), daemon=True)
+        reporter.start()
+        last_seen = {}
+        submitted = set()
+        polls = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+                while max_polls is None or polls < max_polls:
+                    polls += 1
+                    seen = {}
+                    for infile in sorted(glob.glob(os.path.join(directory, pattern))):
+                        try:
+                            seen[infile] = self.file_signature(infile)
+                        except FileNotFoundError:
+                            continue
+                    ## only files still in the directory are remembered, so both sets stay bounded by its size
+                    submitted = {(infile, signature) for infile, signature in submitted if seen.get(infile) == signature}
+                    for infile, signature in seen.items():
+                        if signature != last_seen.get(infile) or (infile, signature) in submitted:
+                            continue
+                        submitted.add((infile, signature))
+                        job = {'infile': infile}
+                        if self.worker_manifest.completed('job', self.job_key(job), signature) is not None:
+                            continue
+                        print(f"Queued {infile}")
+                        executor.submit(self.run_job, job, self.job_name(job))
+                    last_seen = seen
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("Stopping, waiting for running jobs to finish")
+        finally:
+            stop.set()
+        return self.summary()
@@ -0,0 +1,49 @@
+class DurationModel:
+    ## Predicts how long a sentence will be when re-synthesized at a different prosody rate.
+    ## The model is duration_at_rate = slope * (default_duration / rate) + intercept, fitted per voice
+    ## from a small sample of sentences that were actually synthesized at that rate.
+    def __init__(self, voice_name=None, slope=1.0, intercept=0.0):
+        self.voice_name = voice_name
+        self.slope = slope
+        self.intercept = intercept
+
+    def predict(self, default_duration, prosody_rate):
+        return max(0.0, self.slope * (default_duration / prosody_rate) + self.intercept)
+
+    def fit(self, samples):
+        ## samples is a list of (default_duration, prosody_rate, measured_duration) tuples
+        self.slope, self.intercept = self._least_squares(samples)
+        return self
+
+    @staticmethod
+    def _least_squares(samples):
+        xs = [default_duration / prosody_rate for default_duration, prosody_rate, _ in samples]
+        ys = [measured for _, _, measured in samples]
+        if len(samples) < 2:
+            ## not enough points for a line, keep the pure 1/rate scaling and correct the bias
+            if samples:
+                return 1.0, ys[0] - xs[0]
+            return 1.0, 0.0
+
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        variance = sum((x - mean_x) ** 2 for x in xs)
+        if variance == 0:
+            return 1.0, mean_y - mean_x
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+        return slope, mean_y - slope * mean_x
+
+    def cross_validate(self, samples):
+        ## leave-one-out error, an honest estimate of how far predictions land from measured durations
+        errors = []
+        for i, (default_duration, prosody_rate, measured) in enumerate(samples):
+            held_out = DurationModel(self.voice_name).fit(samples[:i] + samples[i + 1:])
+            errors.append(held_out.predict(default_duration, prosody_rate) - measured)
+
+        report = {'voice_name': self.voice_name, 'slope': self.slope, 'intercept': self.intercept, 'sample_size': len(samples)}
+        if errors:
+            absolute_errors = [abs(e) for e in errors]
+            report['mean_abs_error_sec'] = sum(absolute_errors) / len(absolute_errors)
+            report['max_abs_error_sec'] = max(absolute_errors)
+            report['mean_error_sec'] = sum(errors) / len(errors)
+        return report
@@ -0,0 +1,36 @@
+import difflib
+
+## fields that describe a sentence's synthesized audio and carry over to an unchanged sentence
+REUSED_FIELDS = (
+    'audio_file',
+    'actual_duration',
+    'default_rate_duration',
+    'prosody_rate',
+    'solved_prosody_rate',
+    'phrase_ssml',
+    'duration_predicted',
+)
+
+
+def align_sentences(previous_sentences, sentences_list):
+    ## Map each new sentence index to the previous sentence with the same text. difflib keeps the
+    ## matches in order, so a repeated line ("Yes.") pairs with its own occurrence and inserted or
+    ## deleted captions don't shift everything after them.
+    matcher = difflib.SequenceMatcher(
+        None,
+        [sentence['text'] for sentence in previous_sentences],
+        [sentence['text'] for sentence in sentences_list],
+        autojunk=False
+    )
+    matches = {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                matches[j1 + offset] = i1 + offset
+    return matches
+
+
+def most_common_rate(previous_sentences, default=1):
+    ## the prosody rate most of the previous run was synthesized at
+    rates = [sentence['prosody_rate'] for sentence in previous_sentences if sentence.get('prosody_rate') is not None]
+    return max(set(rates), key=rates.count) if rates else default
@@ -0,0 +1,198 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    ## Spans/timers and counters for the pipeline. Values are always aggregated in memory for the
+    ## run summary; every span, counter update and observation is also forwarded to the configured sinks.
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.counters = {}
+        self.timers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def incr(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        for sink in self.sinks:
+            sink.counter(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        ## a single measurement such as a queue wait or a batch's drift
+        self._aggregate(name, value, labels)
+        for sink in self.sinks:
+            sink.observation(name, value, labels)
+
+    def _aggregate(self, name, value, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = {'count': 0, 'sum': 0.0, 'min': value, 'max': value}
+            timer['count'] += 1
+            timer['sum'] += value
+            timer['min'] = min(timer['min'], value)
+            timer['max'] = max(timer['max'], value)
+
+    @contextmanager
+    def span(self, name, **labels):
+        start_wall = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            ## sinks get the span itself, so its duration is only aggregated here
+            self._aggregate(f"{name}_seconds", duration, labels)
+            for sink in self.sinks:
+                sink.span(name, start_wall, duration, labels, error)
+
+    def summary(self):
+        def label_text(labels):
+            return ",".join(f"{k}={v}" for k, v in labels)
+
+        with self._lock:
+            counters = {f"{name}{{{label_text(labels)}}}" if labels else name: value for (name, labels), value in self.counters.items()}
+            timers = {}
+            for (name, labels), timer in self.timers.items():
+                timers[f"{name}{{{label_text(labels)}}}" if labels else name] = dict(timer, mean=timer['sum'] / timer['count'])
+        return {'counters': counters, 'timers': timers}
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close(self)
+
+
+class MetricsSink:
+    def span(self, name, start_time, duration, labels, error=None):
+        pass
+
+    def counter(self, name, value, labels):
+        pass
+
+    def observation(self, name, value, labels):
+        pass
+
+    def close(self, metrics):
+        pass
+
+
+class JsonlSink(MetricsSink):
+    ## one JSON event per line, written as it happens
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def _write(self, event):
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def span(self, name, start_time, duration, labels, error=None):
+        event = {'type': 'span', 'name': name, 'start': start_time, 'duration': duration, 'labels': labels}
+        if error is not None:
+            event['error'] = repr(error)
+        self._write(event)
+
+    def counter(self, name, value, labels):
+        self._write({'type': 'counter', 'name': name, 'value': value, 'labels': labels, 'time': time.time()})
+
+    def observation(self, name, value, labels):
+        self._write({'type': 'observation', 'name': name, 'value': value, 'labels': labels, 'time': time.time()})
+
+    def close(self, metrics):
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusTextSink(MetricsSink):
+    ## writes the aggregated counters and timers in the Prometheus text exposition format at the end
+    ## of the run, e.g. for the node_exporter textfile collector
+    def __init__(self, path, prefix='ttml2speech_'):
+        self.path = path
+        self.prefix = prefix
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+        return '{' + ','.join(escaped) + '}'
+
+    def close(self, metrics):
+        lines = []
+        with metrics._lock:
+            counters = sorted(metrics.counters.items())
+            timers = sorted(metrics.timers.items())
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{self._labels(labels)} {value}")
+        for (name, labels), timer in timers:
+            metric = f"{self.prefix}{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} summary")
+                declared.add(metric)
+            lines.append(f"{metric}_count{self._labels(labels)} {timer['count']}")
+            lines.append(f"{metric}_sum{self._labels(labels)} {timer['sum']}")
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class OpenTelemetrySink(MetricsSink):
+    ## forwards spans, counters and observations (as histograms) to the globally configured OpenTelemetry providers
+    def __init__(self, name='ttml2speech'):
+        try:
+            from opentelemetry import trace, metrics
+        except ImportError as e:
+            raise ImportError("The OpenTelemetry sink needs the opentelemetry-api package installed") from e
+        self.tracer = trace.get_tracer(name)
+        self.meter = metrics.get_meter(name)
+        self.instruments = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, start_time, duration, labels, error=None):
+        start_ns = int(start_time * 1e9)
+        span = self.tracer.start_span(name, start_time=start_ns, attributes=labels)
+        if error is not None:
+            span.record_exception(error)
+        span.end(end_time=start_ns + int(duration * 1e9))
+
+    def counter(self, name, value, labels):
+        with self._lock:
+            if name not in self.instruments:
+                self.instruments[name] = self.meter.create_counter(name)
+        self.instruments[name].add(value, attributes=labels)
+
+    def observation(self, name, value, labels):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = self.meter.create_histogram(name)
+        self.histograms[name].record(value, attributes=labels)
+
+
+def sink_from_spec(spec):
+    ## "jsonl:path", "prometheus:path" or "otel"
+    kind, _, target = spec.partition(':')
+    if kind == 'jsonl':
+        return JsonlSink(target or 'metrics.jsonl')
+    if kind == 'prometheus':
+        return PrometheusTextSink(target or 'metrics.prom')
+    if kind in ('otel', 'opentelemetry'):
+        return OpenTelemetrySink()
+    raise ValueError(f"Unknown metrics sink: {spec}")
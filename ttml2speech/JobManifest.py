@@ -0,0 +1,55 @@
+import os
+import json
+import threading
+
+
+class JobManifest:
+    ## Append-only JSONL record of every sentence synthesis in a run: its state, SSML hash,
+    ## audio path and measured duration. Each line is flushed as soon as it is written, so after a
+    ## crash the next run (resume=True) can skip whatever already finished.
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _key(stage, index):
+        return f"{stage}/{index}"
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    ## the last line may be half written if the process was killed mid-append
+                    continue
+                self.records[self._key(record['stage'], record['index'])] = record
+
+    def record(self, stage, index, state, **fields):
+        record = {'stage': stage, 'index': index, 'state': state, **fields}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.records[self._key(stage, index)] = record
+        return record
+
+    def completed(self, stage, index, ssml_hash):
+        ## the finished record for this sentence, if its SSML is unchanged and the audio is still on disk
+        record = self.records.get(self._key(stage, index))
+        if record is None or record['state'] != 'done' or record.get('ssml_hash') != ssml_hash:
+            return None
+        if not os.path.exists(record.get('audio_file', '')):
+            return None
+        return record
+
+    def counts(self):
+        counts = {}
+        for record in self.records.values():
+            counts[record['state']] = counts.get(record['state'], 0) + 1
+        return counts
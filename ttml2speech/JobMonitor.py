@@ -0,0 +1,114 @@
+import os
+import time
+import asyncio
+
+TERMINAL_JOB_STATES = ('Finished', 'Error', 'Canceled')
+
+
+class JobMonitor:
+    ## Tracks many Media Services encode jobs at once on one event loop. Each job is polled with
+    ## exponential backoff (initial_interval growing by backoff up to max_interval, back to
+    ## initial_interval whenever the state changes), and as soon as a job finishes its output
+    ## asset is downloaded, blobs in parallel, while the other jobs are still being watched.
+    ## The SDK clients are blocking, so every call runs on a worker thread. client (the
+    ## AzureMediaServices client) and blob_service_client can be fakes in tests, and so can sleep.
+    def __init__(self, client, resource_group_name, account_name, transform_name, blob_service_client=None,
+                 initial_interval=2, max_interval=30, backoff=1.5, timeout=None, max_parallel_downloads=4, sleep=asyncio.sleep):
+        self.client = client
+        self.resource_group_name = resource_group_name
+        self.account_name = account_name
+        self.transform_name = transform_name
+        self.blob_service_client = blob_service_client
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_parallel_downloads = max(1, max_parallel_downloads)
+        self.sleep = sleep
+        self.polls = 0
+
+    async def submit(self, job_name, job):
+        return await asyncio.to_thread(self.client.jobs.create, self.resource_group_name, self.account_name, self.transform_name, job_name, parameters=job)
+
+    @staticmethod
+    def job_errors(job):
+        ## error messages from the job's outputs, for jobs that ended in Error
+        errors = []
+        for output in getattr(job, 'outputs', None) or []:
+            error = getattr(output, 'error', None)
+            if error is not None:
+                errors.append(getattr(error, 'message', None) or str(error))
+        return errors
+
+    async def wait(self, job_name):
+        started = time.monotonic()
+        interval = self.initial_interval
+        last_state = None
+        while True:
+            job = await asyncio.to_thread(self.client.jobs.get, self.resource_group_name, self.account_name, self.transform_name, job_name)
+            self.polls += 1
+            ## the SDK's JobState is a str enum; compare its value
+            state = getattr(job.state, 'value', job.state)
+            if state != last_state:
+                print(f"{job_name}: {state}")
+                last_state = state
+                interval = self.initial_interval
+            else:
+                interval = min(self.max_interval, interval * self.backoff)
+            if state in TERMINAL_JOB_STATES:
+                return {'job_name': job_name, 'state': state, 'errors': self.job_errors(job), 'seconds': time.monotonic() - started}
+            if self.timeout is not None and time.monotonic() - started > self.timeout:
+                return {'job_name': job_name, 'state': 'TimedOut', 'last_state': state, 'seconds': time.monotonic() - started}
+            await self.sleep(interval)
+
+    async def download_asset(self, asset_name, download_directory, semaphore):
+        ## every blob in the asset's container, at most max_parallel_downloads at a time
+        asset = await asyncio.to_thread(self.client.assets.get, self.resource_group_name, self.account_name, asset_name)
+        container_client = self.blob_service_client.get_container_client(asset.container)
+        blob_names = await asyncio.to_thread(lambda: [blob.name for blob in container_client.list_blobs()])
+        asset_directory = os.path.join(download_directory, asset_name)
+        os.makedirs(asset_directory, exist_ok=True)
+
+        async def download(blob_name):
+            path = os.path.join(asset_directory, blob_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            async with semaphore:
+                await asyncio.to_thread(self._download_blob, container_client, blob_name, path)
+            return path
+
+        return await asyncio.gather(*(download(blob_name) for blob_name in blob_names))
+
+    @staticmethod
+    def _download_blob(container_client, blob_name, path):
+        with open(path, 'wb') as f:
+            container_client.download_blob(blob_name).readinto(f)
+
+    async def track_job(self, job_name, output_asset_name=None, download_directory=None, semaphore=None):
+        result = await self.wait(job_name)
+        if result['state'] == 'Finished' and output_asset_name and download_directory and self.blob_service_client is not None:
+            result['downloads'] = await self.download_asset(output_asset_name, download_directory, semaphore)
+        return result
+
+    async def track(self, jobs, download_directory=None):
+        ## jobs is a list of {'job_name': ..., 'output_asset_name': ...}; results come back in the same order.
+        ## One job failing (even with an exception) does not stop the others being tracked.
+        semaphore = asyncio.Semaphore(self.max_parallel_downloads)
+        results = await asyncio.gather(
+            *(self.track_job(job['job_name'], job.get('output_asset_name'), download_directory, semaphore) for job in jobs),
+            return_exceptions=True
+        )
+        return [
+            {'job_name': job['job_name'], 'state': 'Failed', 'errors': [repr(result)]} if isinstance(result, Exception) else result
+            for job, result in zip(jobs, results)
+        ]
+
+    async def submit_and_track(self, jobs, download_directory=None):
+        ## jobs is a list of {'job_name': ..., 'job': Job(...), 'output_asset_name': ...}; results come back
+        ## in the same order. A job whose submission failed is reported as failed, the others are still tracked.
+        submissions = await asyncio.gather(*(self.submit(job['job_name'], job['job']) for job in jobs), return_exceptions=True)
+        submitted = [job for job, submission in zip(jobs, submissions) if not isinstance(submission, Exception)]
+        tracked = iter(await self.track(submitted, download_directory))
+        return [
+            {'job_name': job['job_name'], 'state': 'SubmitFailed', 'errors': [repr(submission)]} if isinstance(submission, Exception) else next(tracked)
+            for job, submission in zip(jobs, submissions)
+        ]
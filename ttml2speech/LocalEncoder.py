@@ -0,0 +1,61 @@
+import os
+import json
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from ttml2speech.AudioStitcher import AudioStitcher
+
+
+def aac_output_path(input_path, output_directory=None):
+    ## fr-FR_generated_audio.wav -> fr-FR_generated_audio.mp4, next to the input unless a directory is given
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    if base_name == 'enriched_sentences':
+        base_name = os.path.basename(os.path.dirname(os.path.abspath(input_path))) + '_generated_audio'
+    return os.path.join(output_directory or os.path.dirname(input_path), base_name + '.mp4')
+
+
+def encode_aac(input_path, output_path, bitrate='128k', overlap='shift'):
+    ## Runs in a worker process. input_path is a PCM WAV timeline, or an enriched_sentences.json whose
+    ## sentence clips are stitched into one first, so no lossy MP3 generation sits in between.
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is required for local AAC encoding")
+    wav_path = input_path
+    if input_path.endswith('.json'):
+        with open(input_path, 'r', encoding='utf-8') as f:
+            sentences_list = json.load(f)
+        wav_path = os.path.splitext(output_path)[0] + '.wav'
+        AudioStitcher(overlap=overlap).assemble(sentences_list, wav_path)
+    subprocess.run(
+        [ffmpeg, '-y', '-loglevel', 'error', '-i', wav_path, '-vn', '-c:a', 'aac', '-b:a', bitrate, '-movflags', '+faststart', output_path],
+        check=True
+    )
+    return output_path
+
+
+class LocalAacEncoder:
+    ## Encodes the dubbed timelines of several locales to AAC in MP4 on this machine, one ffmpeg per
+    ## locale across a process pool, instead of the upload / transform / job round trip to Media Services.
+    def __init__(self, max_workers=None, bitrate='128k', output_directory=None, overlap='shift'):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.bitrate = bitrate
+        self.output_directory = output_directory
+        self.overlap = overlap
+
+    def encode_all(self, input_paths):
+        ## returns {input path: output path or the exception that stopped it}
+        if self.output_directory:
+            os.makedirs(self.output_directory, exist_ok=True)
+        results = {}
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, max(1, len(input_paths)))) as executor:
+            futures = {
+                input_path: executor.submit(encode_aac, input_path, aac_output_path(input_path, self.output_directory), self.bitrate, self.overlap)
+                for input_path in input_paths
+            }
+            for input_path, future in futures.items():
+                try:
+                    results[input_path] = future.result()
+                except Exception as e:
+                    results[input_path] = e
+        return results
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ttml2speech.RequestScheduler import SynthesisError
+
+
+class MultiTargetDubbing:
+    ## Dubs one TTML into several voice/locale targets in a single run. The TTML is parsed and
+    ## segmented once; every target gets its own converter (and staging subdirectory) sharing the
+    ## sentence timing, synthesizer pool, cache and scheduler. Sentences for all targets are
+    ## interleaved round-robin onto one worker pool so no locale waits behind another. Targets are
+    ## keyed by voice and locale ("VOICE:LANGUAGE"), so two voices of one locale are separate targets.
+    ## With a timing_solver every target gets per-sentence rates instead of its average rate.
+    def __init__(self, converter, targets, max_concurrency=4, predictive=False, prediction_sample_size=10, assembly='ssml', overlap='shift', timing_solver=None):
+        self.converter = converter
+        ## a target given twice is only dubbed once
+        self.targets = list(dict.fromkeys((voice_name, voice_language) for voice_name, voice_language in targets))
+        self.max_concurrency = max(1, max_concurrency)
+        self.predictive = predictive
+        self.prediction_sample_size = prediction_sample_size
+        self.assembly = assembly
+        self.overlap = overlap
+        self.timing_solver = timing_solver
+        self.target_converters = []
+        self.summary = {}
+
+    @staticmethod
+    def target_key(converter):
+        return f"{converter.voice_name}:{converter.voice_language}"
+
+    def synthesize_all(self, executor, clip_audio_directory, prosody_rates):
+        ## submit sentence i of every target before sentence i + 1 of any target
+        futures = []
+        ## each target's synthesis time runs from the start of this pass to its own last sentence
+        finished_at = {self.target_key(c): [] for c in self.target_converters}
+        pass_started = time.perf_counter()
+        longest = max(len(c.sentences_list) for c in self.target_converters)
+        for i in range(longest):
+            for converter in self.target_converters:
+                if i >= len(converter.sentences_list):
+                    continue
+                key = self.target_key(converter)
+                folder_path = os.path.join(converter.output_staging_directory, clip_audio_directory)
+                future = executor.submit(converter.synthesize_sentence, converter.sentences_list[i], i, folder_path, prosody_rates[key])
+                future.add_done_callback(lambda _, key=key: finished_at[key].append(time.perf_counter()))
+                futures.append(future)
+
+        for future in futures:
+            future.result()
+        for key, times in finished_at.items():
+            if times:
+                self.summary[key]['synthesis_seconds'] = self.summary[key].get('synthesis_seconds', 0) + max(times) - pass_started
+
+    def run(self):
+        self.started = time.perf_counter()
+        self.converter.combine_ttml_to_sentences()
+        parse_seconds = time.perf_counter() - self.started
+
+        self.target_converters = [self.converter.for_target(voice_name, voice_language) for voice_name, voice_language in self.targets]
+        for converter in self.target_converters:
+            os.makedirs(os.path.join(converter.output_staging_directory, 'preprocessed'), exist_ok=True)
+            os.makedirs(os.path.join(converter.output_staging_directory, 'prosody_adjusted'), exist_ok=True)
+            self.summary[self.target_key(converter)] = {'voice_name': converter.voice_name, 'voice_language': converter.voice_language, 'sentences': len(converter.sentences_list)}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            self.synthesize_all(executor, 'preprocessed', {self.target_key(c): 1 for c in self.target_converters})
+
+            avg_prosody_rates = {}
+            for converter in self.target_converters:
+                key = self.target_key(converter)
+                adjustments_dict = converter.calculate_prosody_rates(converter.sentences_list)
+                avg_prosody_rates[key] = round(adjustments_dict['avg_prosody'], 1)
+                self.summary[key]['avg_prosody_rate'] = avg_prosody_rates[key]
+
+            if self.timing_solver is not None:
+                for converter in self.target_converters:
+                    timing_report = converter.solve_prosody_rates(converter.sentences_list, timing_solver=self.timing_solver, max_concurrency=self.max_concurrency)
+                    self.summary[self.target_key(converter)]['timing'] = timing_report
+                    with open(os.path.join(converter.output_staging_directory, 'timing_report.json'), 'w', encoding='utf-8') as f:
+                        f.write(json.dumps(timing_report, indent=4))
+            elif self.predictive:
+                for converter in self.target_converters:
+                    key = self.target_key(converter)
+                    self.summary[key]['prediction'] = converter.predict_prosody_adjusted_durations(
+                        converter.sentences_list,
+                        avg_prosody_rate=avg_prosody_rates[key],
+                        sample_size=self.prediction_sample_size,
+                        max_concurrency=self.max_concurrency
+                    )
+            else:
+                self.synthesize_all(executor, 'prosody_adjusted', avg_prosody_rates)
+
+        for converter in self.target_converters:
+            locale_summary = self.summary[self.target_key(converter)]
+            converter.output_sentences_list('enriched_sentences.json')
+            ## one target failing to assemble must not cost the other targets their audio
+            try:
+                final_audio_path = converter.assemble_final_audio(converter.sentences_list, assembly=self.assembly, overlap=self.overlap, max_concurrency=self.max_concurrency)
+            except (SynthesisError, ValueError) as e:
+                converter.log(f"Assembling {self.target_key(converter)} failed: {e}")
+                locale_summary['error'] = str(e)
+                final_audio_path = None
+            if converter.dead_letters:
+                converter.output_dead_letters()
+
+            synthesized = [s['actual_duration'] for s in converter.sentences_list if s.get('actual_duration') is not None]
+            locale_summary['output'] = final_audio_path
+            locale_summary['failed_sentences'] = len(converter.dead_letters)
+            locale_summary['audio_seconds'] = sum(synthesized)
+            locale_summary['total_seconds'] = time.perf_counter() - self.started
+            if locale_summary.get('synthesis_seconds'):
+                locale_summary['sentences_per_second'] = len(synthesized) / locale_summary['synthesis_seconds']
+                locale_summary['audio_seconds_per_second'] = locale_summary['audio_seconds'] / locale_summary['synthesis_seconds']
+
+        return {'parse_seconds': parse_seconds, 'total_seconds': time.perf_counter() - self.started, 'targets': self.summary}
+
+    def dead_letters(self):
+        ## every target's failed sentences, tagged with the target they belong to
+        return [dict(dead_letter, target=self.target_key(converter)) for converter in self.target_converters for dead_letter in converter.dead_letters]
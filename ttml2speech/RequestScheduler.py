@@ -0,0 +1,135 @@
+import time
+import random
+import threading
+
+
+class SynthesisError(Exception):
+    ## A synthesis request the service did not complete. retryable is False for errors that
+    ## will never succeed on a retry (bad SSML, bad credentials).
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ThrottledError(SynthesisError):
+    ## The service rejected the request because we are over our rate limit (HTTP 429)
+    pass
+
+
+class TokenBucket:
+    ## Classic token bucket: refills at rate tokens per second up to capacity, acquire() blocks
+    ## until a token is available.
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class RequestScheduler:
+    ## Sits between TTMLConverter and the speech service. Every call waits for a token (the
+    ## tier's transactions per second) and for a concurrency slot. The concurrency limit grows
+    ## additively on success and is halved on a throttle (AIMD). Failed calls are retried with
+    ## jittered exponential backoff; the last error is raised once max_retries is exhausted.
+    ## When several jobs share the scheduler, a free slot goes to the waiting job with the fewest
+    ## calls in flight, so one large job cannot starve the others.
+    def __init__(self, requests_per_second=20, max_concurrency=8, min_concurrency=1, max_retries=5,
+                 base_delay=0.5, max_delay=30, rng=None, clock=time.monotonic, sleep=time.sleep, metrics=None):
+        self.bucket = TokenBucket(requests_per_second, clock=clock, sleep=sleep)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency_limit = float(self.max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+        self.sleep = sleep
+        self.in_flight = 0
+        self.job_in_flight = {}
+        self.job_waiting = {}
+        self.metrics = metrics
+        self.stats = {'calls': 0, 'successes': 0, 'throttles': 0, 'retries': 0, 'failures': 0}
+        self._condition = threading.Condition()
+
+    def _next_job(self, job):
+        ## only the waiting job(s) with the fewest calls in flight may take a slot
+        fewest = min(self.job_in_flight.get(waiting, 0) for waiting, count in self.job_waiting.items() if count)
+        return self.job_in_flight.get(job, 0) == fewest
+
+    def _acquire_slot(self, job=None):
+        with self._condition:
+            self.job_waiting[job] = self.job_waiting.get(job, 0) + 1
+            while self.in_flight >= int(self.concurrency_limit) or not self._next_job(job):
+                self._condition.wait()
+            self.job_waiting[job] -= 1
+            self.job_in_flight[job] = self.job_in_flight.get(job, 0) + 1
+            self.in_flight += 1
+            ## another job may be next in line for a remaining slot
+            self._condition.notify_all()
+
+    def _release_slot(self, throttled=False, job=None):
+        with self._condition:
+            self.in_flight -= 1
+            self.job_in_flight[job] -= 1
+            ## forget a job with nothing in flight or waiting, so a long running worker doesn't keep every job it ran
+            if self.job_in_flight[job] == 0 and not self.job_waiting.get(job):
+                del self.job_in_flight[job]
+                self.job_waiting.pop(job, None)
+            if throttled:
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+            else:
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+            self._condition.notify_all()
+
+    def backoff_delay(self, attempt):
+        ## full jitter: anywhere between zero and the exponential cap
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, job=None):
+        attempt = 0
+        while True:
+            self._acquire_slot(job)
+            self.bucket.acquire()
+            with self._condition:
+                self.stats['calls'] += 1
+            try:
+                result = fn()
+            except SynthesisError as e:
+                throttled = isinstance(e, ThrottledError)
+                self._release_slot(throttled=throttled, job=job)
+                with self._condition:
+                    if throttled:
+                        self.stats['throttles'] += 1
+                    if not e.retryable or attempt >= self.max_retries:
+                        self.stats['failures'] += 1
+                        raise
+                    self.stats['retries'] += 1
+                if self.metrics is not None:
+                    self.metrics.incr('synthesis_retries_total', reason='throttle' if throttled else 'error')
+                self.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                self._release_slot(job=job)
+                with self._condition:
+                    self.stats['failures'] += 1
+                raise
+            self._release_slot(job=job)
+            with self._condition:
+                self.stats['successes'] += 1
+            return result
@@ -0,0 +1,87 @@
+from ttml2speech.TTMLParser import parse_time_expression
+
+_numpy = None
+
+
+def numpy_module():
+    ## NumPy is slow to import, so it is loaded the first time a table is built rather than at startup
+    global _numpy
+    if _numpy is None:
+        import numpy
+        _numpy = numpy
+    return _numpy
+
+
+def timestamp_seconds(sentence, key):
+    ## Numeric seconds for a sentence's 'begin' or 'end'. The parser stores these alongside the
+    ## strings, so the string is only parsed for sentences that came from an older JSON file.
+    seconds = sentence.get(f"{key}_seconds")
+    if seconds is None:
+        seconds = parse_time_expression(sentence[key])
+    return seconds
+
+
+class SentenceTable:
+    ## Columnar timing data for a sentences_list: begin, end, target and actual durations in
+    ## seconds, one NumPy float column each, with the computations below vectorized.
+    ## Missing actual durations (not yet synthesized, or failed) are NaN.
+    columns = ('begin', 'end', 'target_duration', 'actual_duration')
+
+    def __init__(self, begin, end, target_duration, actual_duration):
+        self.begin = begin
+        self.end = end
+        self.target_duration = target_duration
+        self.actual_duration = actual_duration
+
+    @staticmethod
+    def _column(values, count):
+        return numpy_module().fromiter(values, dtype=float, count=count)
+
+    @staticmethod
+    def _actual_durations(sentences_list):
+        nan = float('nan')
+        return SentenceTable._column((nan if s.get('actual_duration') is None else s['actual_duration'] for s in sentences_list), len(sentences_list))
+
+    @classmethod
+    def from_sentences(cls, sentences_list):
+        count = len(sentences_list)
+        return cls(
+            cls._column((timestamp_seconds(s, 'begin') for s in sentences_list), count),
+            cls._column((timestamp_seconds(s, 'end') for s in sentences_list), count),
+            cls._column((s['target_duration'] for s in sentences_list), count),
+            cls._actual_durations(sentences_list),
+        )
+
+    def refresh_actual_durations(self, sentences_list):
+        ## timings are fixed once the TTML is parsed, only the actual durations change as clips are synthesized
+        self.actual_duration = self._actual_durations(sentences_list)
+        return self
+
+    def __len__(self):
+        return len(self.begin)
+
+    def prosody_rates(self):
+        ## actual / target per sentence, NaN where there is no measurement or no target duration
+        np = numpy_module()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.target_duration > 0, self.actual_duration / self.target_duration, np.nan)
+
+    @staticmethod
+    def nanmean(values, default=None):
+        np = numpy_module()
+        values = np.asarray(values)
+        finite = values[~np.isnan(values)]
+        return float(finite.mean()) if finite.size else default
+
+    def gaps(self):
+        ## silence before each sentence: from the end of the previous one (from 0 for the first),
+        ## negative where captions overlap
+        return self.begin - numpy_module().concatenate(([0.0], self.end[:-1]))
+
+    def slot_durations(self):
+        ## time each sentence may fill: until the next sentence begins, the last one its own target duration
+        return numpy_module().concatenate((self.begin[1:] - self.begin[:-1], self.target_duration[-1:]))
+
+    def batch_numbers(self, batch_min_mark=5):
+        ## which batch_min_mark-minute bucket each sentence's end falls into
+        return (self.end / 60 // int(batch_min_mark)).astype(int)
@@ -0,0 +1,185 @@
+import io
+import re
+import math
+import time
+import wave
+import random
+import threading
+import xml.etree.ElementTree as xml
+
+from ttml2speech.RequestScheduler import SynthesisError, ThrottledError
+from ttml2speech.TTMLParser import local_name
+
+
+class SynthesisBackend:
+    ## What TTMLConverter calls to turn SSML into audio bytes in the requested output format.
+    ## Implementations raise ThrottledError / SynthesisError for requests that did not complete.
+    name = None
+
+    def synthesize(self, ssml, voice_name, voice_language, output_format):
+        raise NotImplementedError
+
+    def warm_up(self, voice_name, voice_language, output_format, count=1):
+        pass
+
+    def close(self):
+        pass
+
+
+class AzureSpeechBackend(SynthesisBackend):
+    ## The Azure Cognitive Services Speech SDK, through a pool of warm synthesizers.
+    ## The pool (and with it the SDK) is only created by the first request, which also opens
+    ## warm_up_count connections for its voice and format, so the requests that follow don't pay
+    ## for the handshake and a run served entirely from the synthesis cache never loads the SDK.
+    name = 'azure'
+
+    def __init__(self, speech_key, service_region, synthesizer_pool=None, warm_up_count=1):
+        self.speech_key = speech_key
+        self.service_region = service_region
+        self.synthesizer_pool = synthesizer_pool
+        self.warm_up_count = warm_up_count
+        self._warmed_up = set()
+        self._lock = threading.Lock()
+        self._warm_up_lock = threading.Lock()
+
+    def get_synthesizer_pool(self):
+        with self._lock:
+            if self.synthesizer_pool is None:
+                from ttml2speech.SynthesizerPool import SynthesizerPool
+                self.synthesizer_pool = SynthesizerPool(self.speech_key, self.service_region)
+            return self.synthesizer_pool
+
+    def warm_up(self, voice_name, voice_language, output_format, count=1):
+        self.get_synthesizer_pool().warm_up(voice_name, voice_language, output_format, count)
+
+    def speak_ssml(self, ssml, voice_name, voice_language, output_format):
+        key = (voice_name, voice_language, output_format)
+        if key not in self._warmed_up:
+            with self._warm_up_lock:
+                if key not in self._warmed_up:
+                    self.warm_up(voice_name, voice_language, output_format, self.warm_up_count)
+                    self._warmed_up.add(key)
+        return self.get_synthesizer_pool().speak_ssml(ssml, voice_name, voice_language, output_format)
+
+    def synthesize(self, ssml, voice_name, voice_language, output_format):
+        from azure.cognitiveservices.speech import ResultReason
+        result = self.speak_ssml(ssml, voice_name, voice_language, output_format)
+        if result.reason != ResultReason.SynthesizingAudioCompleted:
+            raise self.synthesis_error_for_result(result)
+        return result.audio_data
+
+    def synthesis_error_for_result(self, result):
+        from azure.cognitiveservices.speech import CancellationErrorCode
+        cancellation_details = result.cancellation_details
+        if cancellation_details is None:
+            return SynthesisError(f"Speech synthesis did not complete: {result.reason}")
+        message = f"{cancellation_details.reason}: {cancellation_details.error_details}"
+        error_code = cancellation_details.error_code
+        if error_code == CancellationErrorCode.TooManyRequests:
+            return ThrottledError(message)
+        if error_code in (CancellationErrorCode.AuthenticationFailure, CancellationErrorCode.BadRequest, CancellationErrorCode.Forbidden):
+            return SynthesisError(message, retryable=False)
+        return SynthesisError(message)
+
+    def close(self):
+        if self.synthesizer_pool is not None:
+            self.synthesizer_pool.close()
+
+
+class LocalSpeechBackend(SynthesisBackend):
+    ## Deterministic offline stand-in for benchmarking and load tests. It turns SSML into a WAV
+    ## whose length follows the text length, <prosody rate> and <break> elements, after an
+    ## optional simulated latency, and can inject throttles and failures at configurable rates.
+    ## Every output format is rendered as 16 bit mono PCM in a RIFF container at the format's
+    ## sample rate; MP3 formats are not encoded.
+    name = 'local'
+
+    rate_keywords = {'x-slow': 0.5, 'slow': 0.64, 'medium': 1.0, 'default': 1.0, 'fast': 1.55, 'x-fast': 2.0}
+    strength_seconds = {'none': 0.0, 'x-weak': 0.1, 'weak': 0.25, 'medium': 0.5, 'strong': 0.75, 'x-strong': 1.0}
+
+    def __init__(self, characters_per_second=15.0, latency_seconds=0.0, latency_jitter=0.0, error_rate=0.0, throttle_rate=0.0, seed=0):
+        self.characters_per_second = characters_per_second
+        self.latency_seconds = latency_seconds
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse_rate(cls, value):
+        value = (value or '1').strip()
+        if value in cls.rate_keywords:
+            return cls.rate_keywords[value]
+        if value.endswith('%'):
+            return max(0.01, 1 + float(value[:-1]) / 100)
+        return max(0.01, float(value))
+
+    @classmethod
+    def parse_break(cls, element):
+        time_value = element.get('time')
+        if time_value is None:
+            return cls.strength_seconds.get(element.get('strength', 'medium'), 0.5)
+        match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*(ms|s)?\s*$', time_value)
+        if not match:
+            return 0.0
+        ## a unitless break time is read as milliseconds, which is what build_ssml writes
+        number, unit = float(match.group(1)), match.group(2)
+        return number if unit == 's' else number / 1000
+
+    def ssml_duration(self, ssml):
+        ## seconds of audio the SSML would produce
+        root = xml.fromstring(ssml)
+
+        def walk(element, rate):
+            seconds = 0.0
+            name = local_name(element.tag)
+            if name == 'prosody':
+                rate = rate * self.parse_rate(element.get('rate'))
+            if name == 'break':
+                seconds += self.parse_break(element)
+            if element.text and element.text.strip():
+                seconds += len(element.text.strip()) / self.characters_per_second / rate
+            for child in element:
+                seconds += walk(child, rate)
+                if child.tail and child.tail.strip():
+                    seconds += len(child.tail.strip()) / self.characters_per_second / rate
+            return seconds
+
+        return walk(root, 1.0)
+
+    @staticmethod
+    def sample_rate_for_format(output_format):
+        match = re.search(r'(\d+)Khz', output_format)
+        return int(match.group(1)) * 1000 if match else 16000
+
+    def render_wav(self, duration_seconds, sample_rate):
+        ## a quiet 220 Hz tone, built by repeating a single period so long clips stay cheap
+        frames = int(round(duration_seconds * sample_rate))
+        period = max(1, sample_rate // 220)
+        cycle = b''.join(
+            int(1000 * math.sin(2 * math.pi * i / period)).to_bytes(2, 'little', signed=True)
+            for i in range(period)
+        )
+        samples = (cycle * (frames // period + 1))[:frames * 2]
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(sample_rate)
+            w.writeframes(samples)
+        return buffer.getvalue()
+
+    def synthesize(self, ssml, voice_name, voice_language, output_format):
+        with self._lock:
+            self.calls += 1
+            roll = self._rng.random()
+            latency = self.latency_seconds + self._rng.uniform(0, self.latency_jitter)
+        if latency > 0:
+            time.sleep(latency)
+        if roll < self.throttle_rate:
+            raise ThrottledError("Local backend injected throttle (429)")
+        if roll < self.throttle_rate + self.error_rate:
+            raise SynthesisError("Local backend injected failure")
+        return self.render_wav(self.ssml_duration(ssml), self.sample_rate_for_format(output_format))
@@ -0,0 +1,102 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class SynthesisCache:
+    ## Persistent, content-addressed store of synthesized audio.
+    ## Entries are keyed on the SSML plus voice, language, output format and synthesis backend, and the least recently
+    ## used files are evicted once the directory grows past max_size_bytes, down to
+    ## low_watermark * max_size_bytes so a full cache is not trimmed again on every put.
+    ## Recency is tracked in memory (seeded from file mtimes), so eviction never rescans the directory.
+    def __init__(self, cache_directory=os.path.join('outputs', '.synthesis_cache'), max_size_bytes=2 * 1024 ** 3, low_watermark=0.9):
+        self.cache_directory = cache_directory
+        self.max_size_bytes = max_size_bytes
+        self.low_watermark = low_watermark
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_directory, exist_ok=True)
+        ## key -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        entries = []
+        for path in self._entry_paths():
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, os.path.basename(path)[:-len('.bin')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+        self._size_bytes = sum(self._entries.values())
+
+    @staticmethod
+    def make_key(ssml, voice_name, voice_language, output_format, backend_name):
+        ## the backend is part of the key so audio from the local stand-in is never served as real speech
+        digest = hashlib.sha256()
+        for part in (backend_name, voice_name, voice_language, output_format, ssml):
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_directory, key[:2], f"{key}.bin")
+
+    def _entry_paths(self):
+        for root, _, files in os.walk(self.cache_directory):
+            for name in files:
+                if name.endswith('.bin'):
+                    yield os.path.join(root, name)
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            ## bump the mtime so eviction treats this entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                self._size_bytes -= self._entries.pop(key, 0)
+            return None
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ## write to a temporary file first so a crash never leaves a truncated entry behind; mkstemp names
+        ## it uniquely, since other threads and processes sharing the cache may be writing the same key
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{key}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        with self._lock:
+            self._size_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            over_limit = self._size_bytes > self.max_size_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        ## drop least recently used entries until the cache is back under the low watermark
+        target_bytes = self.max_size_bytes * self.low_watermark
+        with self._lock:
+            while self._entries and self._size_bytes > target_bytes:
+                key, size = self._entries.popitem(last=False)
+                self._size_bytes -= size
+                try:
+                    os.remove(self._entry_path(key))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size_bytes': self._size_bytes, 'entries': len(self._entries)}
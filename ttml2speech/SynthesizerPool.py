@@ -0,0 +1,82 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import azure.cognitiveservices.speech as speechsdk
+
+
+class SynthesizerPool:
+    ## Keeps warm SpeechSynthesizer objects (one idle queue per voice/language/format) so that
+    ## every clip doesn't pay for a new SpeechConfig, connection and TLS handshake.
+    ## Synthesizers are created without an AudioConfig; callers write result.audio_data themselves.
+    def __init__(self, speech_key, service_region, synthesizer_factory=None, connection_opener=None):
+        self.speech_key = speech_key
+        self.service_region = service_region
+        self.synthesizer_factory = synthesizer_factory or self.create_synthesizer
+        self.connection_opener = connection_opener or self.open_connection
+        self.constructions = 0
+        self.connections_opened = 0
+        self._idle = {}
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def create_synthesizer(self, voice_name, voice_language, output_format):
+        speech_config = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.service_region)
+        speech_config.speech_synthesis_language = voice_language
+        speech_config.speech_synthesis_voice_name = voice_name
+        speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat[output_format])
+        return speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+
+    def open_connection(self, synthesizer):
+        ## pre-open the websocket so the first request doesn't wait on the handshake
+        connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+        connection.open(True)
+        return connection
+
+    def _idle_queue(self, key):
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = queue.LifoQueue()
+            return self._idle[key]
+
+    def _new_synthesizer(self, key):
+        synthesizer = self.synthesizer_factory(*key)
+        connection = self.connection_opener(synthesizer)
+        with self._lock:
+            self.constructions += 1
+            if connection is not None:
+                self.connections_opened += 1
+                ## hold on to the connection, otherwise it is closed when garbage collected
+                self._connections[id(synthesizer)] = connection
+        return synthesizer
+
+    def warm_up(self, voice_name, voice_language, output_format, count=1):
+        key = (voice_name, voice_language, output_format)
+        idle = self._idle_queue(key)
+        for _ in range(max(0, count - idle.qsize())):
+            idle.put(self._new_synthesizer(key))
+
+    @contextmanager
+    def synthesizer(self, voice_name, voice_language, output_format):
+        key = (voice_name, voice_language, output_format)
+        idle = self._idle_queue(key)
+        try:
+            synthesizer = idle.get_nowait()
+        except queue.Empty:
+            synthesizer = self._new_synthesizer(key)
+        try:
+            yield synthesizer
+        finally:
+            idle.put(synthesizer)
+
+    def speak_ssml(self, ssml, voice_name, voice_language, output_format):
+        with self.synthesizer(voice_name, voice_language, output_format) as synthesizer:
+            return synthesizer.speak_ssml_async(ssml).get()
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+            self._idle = {}
+        for connection in connections:
+            connection.close()
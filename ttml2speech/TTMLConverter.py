@@ -1,28 +1,60 @@
-from audioop import avg
 import os
-from bs4 import BeautifulSoup
 from datetime import datetime
-from dotenv import load_dotenv
 import json
 import string
-import azure.cognitiveservices.speech as speechsdk
 import wave
 import contextlib
 import xml.etree.ElementTree as xml
 import shutil
 import random
+import io
+import copy
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ttml2speech.DurationModel import DurationModel
+from ttml2speech.TTMLParser import iter_ttml_sentences, parse_time_expression
+from ttml2speech.SentenceTable import SentenceTable, timestamp_seconds
+from ttml2speech.SynthesisCache import SynthesisCache
+from ttml2speech.JobManifest import JobManifest
+from ttml2speech.RequestScheduler import SynthesisError
+from ttml2speech.SpeechBackends import AzureSpeechBackend
+from ttml2speech.AudioStitcher import AudioStitcher
+from ttml2speech.Instrumentation import Metrics
+from ttml2speech.TimingSolver import TimingSolver
+from ttml2speech.IncrementalRedub import REUSED_FIELDS, align_sentences, most_common_rate
 
 class TTMLConverter:
-    def __init__(self, ttml_text = None, ttml_file_path = None, output_staging_directory = None, prefix = 'tts'):
+    def __init__(self, ttml_text = None, ttml_file_path = None, output_staging_directory = None, prefix = 'tts', resume = False):
         self.speech_key = ""
         self.service_region = ""
         self.voice_name = ""
         self.voice_language = ""
         self.prefix = prefix
+        self.resume = resume
         self.target_audio_format = 'Riff16Khz16BitMonoPcm'
+        self.synthesis_backend = None
+        self.synthesis_cache = None
+        self.request_scheduler = None
+        ## identifies this converter's requests when several jobs share the request scheduler
+        self.job_name = None
+        ## packs the final synthesis batches; None keeps the fixed batch_min_mark minute buckets
+        self.batch_partitioner = None
+        ## batch_audio directories of earlier runs whose final batches may be reused
+        self.previous_batch_directories = []
+        self.dead_letters = []
+        ## columnar timings of the sentences last passed to sentence_table()
+        self._sentence_table = None
+        self._sentence_table_source = None
+        self.metrics = Metrics()
+        ## quiet drops the per-sentence console output from the hot path
+        self.quiet = False
+        ## a TTML file is streamed from disk when parsed rather than held in memory
+        self.ttml_file_path = ttml_file_path
+        self.ttml_text = None
         if ttml_file_path is not None:
-            with open(ttml_file_path, 'r', encoding="utf-8") as f:
-                self.ttml_text = f.read()
+            if not os.path.exists(ttml_file_path):
+                raise FileNotFoundError(ttml_file_path)
         elif ttml_text is not None:
             self.ttml_text = ttml_text
         else:
@@ -34,77 +66,304 @@ class TTMLConverter:
         else:
             self.output_staging_directory = os.path.join('outputs', output_staging_directory)
 
-        ## clear the staging directory and create it
-        if os.path.exists(self.output_staging_directory):
+        ## clear the staging directory and create it, unless we are resuming a previous run in it
+        if os.path.exists(self.output_staging_directory) and not resume:
             shutil.rmtree(self.output_staging_directory) 
         
-        os.makedirs(self.output_staging_directory)
+        os.makedirs(self.output_staging_directory, exist_ok=True)
+        self.job_manifest = JobManifest(os.path.join(self.output_staging_directory, 'job_manifest.jsonl'))
 
         ## Copy the starting TTML to the target directory
         new_ttml_path = os.path.join('./', self.output_staging_directory, 'starting_text.ttml')
-        with open(new_ttml_path, 'w', encoding='utf-8') as f:
-            f.write(self.ttml_text)
+        if self.ttml_file_path is not None:
+            shutil.copyfile(self.ttml_file_path, new_ttml_path)
+        else:
+            with open(new_ttml_path, 'w', encoding='utf-8') as f:
+                f.write(self.ttml_text)
+
+    def for_target(self, voice_name, voice_language):
+        ## A converter for another voice/locale that shares this one's TTML, parsed sentences,
+        ## synthesis backend, cache and scheduler, staged in a subdirectory per voice, so two voices
+        ## of the same locale never share clips or final audio.
+        target = TTMLConverter(
+            ttml_text=self.ttml_text,
+            ttml_file_path=self.ttml_file_path,
+            output_staging_directory=os.path.join(os.path.relpath(self.output_staging_directory, 'outputs'), f"{voice_language}_{voice_name}"),
+            prefix=self.prefix,
+            resume=self.resume
+        )
+        target.speech_key = self.speech_key
+        target.service_region = self.service_region
+        target.voice_name = voice_name
+        target.voice_language = voice_language
+        target.target_audio_format = self.target_audio_format
+        target.synthesis_backend = self.get_synthesis_backend()
+        target.synthesis_cache = self.synthesis_cache
+        target.request_scheduler = self.request_scheduler
+        target.batch_partitioner = self.batch_partitioner
+        target.metrics = self.metrics
+        target.quiet = self.quiet
+        target.sentences_list = copy.deepcopy(getattr(self, 'sentences_list', []))
+        return target
+
+    def iter_ttml_sentences(self):
+        ## generator over the sentences in the TTML, yielded while the document is still being read
+        if self.ttml_file_path is not None:
+            return iter_ttml_sentences(self.ttml_file_path)
+        return iter_ttml_sentences(io.BytesIO(self.ttml_text.encode('utf-8')))
+
+    def log(self, *args):
+        if not self.quiet:
+            print(*args)
 
     def combine_ttml_to_sentences(self):
-        self.sentences_list = []
-        sentences_list = []
-        sentence_dict = {'text': '', 'begin': '', 'end': ''}
-        soup = BeautifulSoup(self.ttml_text, features="html.parser")
-        captions = soup.select('p')
-              
-        for phrase in captions:
-            ## get the first timestamp the first time through
-            if not sentence_dict['begin']:
-                sentence_dict['begin'] = phrase['begin']
-            else: 
-                sentence_dict['begin'] = min(phrase['begin'], sentence_dict['begin'])
-            
-            ## get the largest end timestamp in the sentence. 
-            sentence_dict['end'] = max(phrase['end'], sentence_dict['end'])
-            
-            ## add the sentence to the dict
-            if not sentence_dict['text']:
-                sentence_dict['text'] = phrase.text.strip()
-            else:
-                sentence_dict['text'] = sentence_dict['text'] + " " + phrase.text.strip()
+        with self.metrics.span('combine_ttml_to_sentences'):
+            self.sentences_list = list(self.iter_ttml_sentences())
+        self.metrics.incr('sentences_parsed_total', len(self.sentences_list))
+        return self.sentences_list
 
-            ## If this is the end of a sentence, add it to the list of sentences
-            if phrase.text[-1] in ".!?":
-                begin = datetime.strptime(sentence_dict["begin"], "%H:%M:%S.%f")
-                end = datetime.strptime(sentence_dict["end"], "%H:%M:%S.%f")
-                duration = end - begin
-                sentence_dict['target_duration'] = duration.total_seconds()
-                sentence_dict['character_length'] = len(sentence_dict['text'])
+    def dub(self, max_concurrency=1, predictive=False, prediction_sample_size=10, timing_solver=None, assembly='ssml', overlap='shift'):
+        ## The standard run over the whole TTML: a first pass at the default rate, a prosody adjusted
+        ## second pass (full, predicted from a sample, or solved per sentence) and the final audio.
+        ## Returns a report of what each stage did.
+        dub_report = {}
+        sentences_list = self.combine_ttml_to_sentences()
 
-                sentences_list.append(sentence_dict)
-                sentence_dict = {'text': '', 'begin': '', 'end': ''}     
+        sentences_list = self.pre_process_audio_snippets(
+            sentences_list=sentences_list,
+            max_concurrency=max_concurrency
+        )
 
+        ## Get determine the rate to apply to hte voice to most closely match the original. 
+        ## Then Re-preprocess audio snippet but include the average prosody rate
+        adjustments_dict = self.calculate_prosody_rates(sentences_list=sentences_list)
+        avg_prosody_rate = adjustments_dict['avg_prosody']
+        dub_report['avg_prosody_rate'] = avg_prosody_rate
+
+        if timing_solver is not None:
+            dub_report['timing'] = self.solve_prosody_rates(sentences_list, timing_solver=timing_solver, max_concurrency=max_concurrency)
+            with open(os.path.join(self.output_staging_directory, 'timing_report.json'), 'w', encoding='utf-8') as f:
+                f.write(json.dumps(dub_report['timing'], indent=4))
+        elif predictive:
+            dub_report['prediction'] = self.predict_prosody_adjusted_durations(sentences_list, avg_prosody_rate=round(avg_prosody_rate, 1), sample_size=prediction_sample_size, max_concurrency=max_concurrency)
+        else:
+            self.pre_process_audio_snippets(sentences_list, clip_audio_directory='prosody_adjusted', avg_prosody_rate=round(avg_prosody_rate, 1), max_concurrency=max_concurrency)
+
+        ## write out the sentences list to file
+        self.output_sentences_list('enriched_sentences.json')
+
+        dub_report['output'] = self.assemble_final_audio(sentences_list, assembly=assembly, overlap=overlap, max_concurrency=max_concurrency)
+        dub_report['sentences'] = len(sentences_list)
+        dub_report['failed_sentences'] = len(self.dead_letters)
+        return dub_report
+
+    def pre_process_audio_snippets(self, sentences_list, clip_audio_directory="preprocessed", avg_prosody_rate=1, max_concurrency=1):
+        temp_audio_folder_path = os.path.join(self.output_staging_directory, clip_audio_directory)
+        os.makedirs(temp_audio_folder_path, exist_ok=True)
+
+        ## max_concurrency bounds how many synthesis requests are in flight at once.
+        ## Each worker only touches its own sentence, so ordering and enrichment are unchanged.
+        with self.metrics.span('pre_process_audio_snippets', stage=clip_audio_directory, voice_language=self.voice_language):
+            if max_concurrency <= 1:
+                for i, sentence in enumerate(sentences_list):
+                    self.synthesize_sentence(sentence, i, temp_audio_folder_path, avg_prosody_rate)
+            else:
+                with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                    futures = [
+                        executor.submit(self.synthesize_sentence, sentence, i, temp_audio_folder_path, avg_prosody_rate, time.perf_counter())
+                        for i, sentence in enumerate(sentences_list)
+                    ]
+                    for future in futures:
+                        future.result()
+        
         self.sentences_list = sentences_list
         return sentences_list
 
-    def pre_process_audio_snippets(self, sentences_list, clip_audio_directory="preprocessed", avg_prosody_rate=1):
+    def synthesize_sentence(self, sentence, index, temp_audio_folder_path, avg_prosody_rate=1, queued_at=None):
+        stage = os.path.basename(temp_audio_folder_path)
+        if queued_at is not None:
+            self.metrics.observe('synthesis_queue_wait_seconds', time.perf_counter() - queued_at, stage=stage)
+        filename = os.path.join(temp_audio_folder_path, f"{self.prefix}_{index}.wav")
+        self.log(filename)
+        sentence['audio_file'] = filename
+        
+        ## get the SSML for the sentence
+        phrase_ssml = self.build_ssml([sentence], insert_breaks=False, output_files = False, prosody_rate=avg_prosody_rate)
+        sentence['phrase_ssml'] = phrase_ssml
+        sentence['prosody_rate'] = avg_prosody_rate
+        
+        ## skip sentences a previous, interrupted run already finished
+        ssml_hash = self.synthesis_key(phrase_ssml, self.target_audio_format)
+        completed = self.job_manifest.completed(stage, index, ssml_hash)
+        if completed is not None:
+            self.metrics.incr('sentences_resumed_total', stage=stage)
+            sentence['audio_file'] = completed['audio_file']
+            sentence['actual_duration'] = completed['actual_duration']
+            return sentence
+
+        self.log(f"This is the phrase_ssml: {phrase_ssml}")
+        try:
+            audio_data = self.synthesize_ssml(phrase_ssml)
+        except SynthesisError as e:
+            ## give up on this sentence rather than leaving an empty WAV with a zero duration behind
+            sentence['audio_file'] = None
+            sentence['actual_duration'] = None
+            sentence['synthesis_failed'] = True
+            self.dead_letters.append({'stage': stage, 'index': index, 'text': sentence['text'], 'error': str(e)})
+            self.job_manifest.record(stage, index, 'failed', ssml_hash=ssml_hash, error=str(e))
+            self.metrics.incr('sentences_failed_total', stage=stage, voice_language=self.voice_language)
+            return sentence
+        self.write_audio_data(audio_data, filename)
+
+        sentence['actual_duration'] = self.calculate_duration(sentence['audio_file'])
+        self.job_manifest.record(stage, index, 'done', ssml_hash=ssml_hash, audio_file=filename, actual_duration=sentence['actual_duration'])
+        self.metrics.incr('sentences_synthesized_total', stage=stage, voice_language=self.voice_language)
+        return sentence
+
+    def predict_prosody_adjusted_durations(self, sentences_list, avg_prosody_rate, clip_audio_directory="prosody_adjusted", sample_size=10, max_concurrency=1):
+        ## Instead of a full second pass, re-synthesize an evenly spaced sample at the new rate,
+        ## fit a duration model for this voice and predict the remaining durations.
+        for sentence in sentences_list:
+            sentence['default_rate_duration'] = sentence['actual_duration']
+
+        sample_size = min(max(sample_size, 0), len(sentences_list))
+        if sample_size:
+            step = len(sentences_list) / sample_size
+            sample_indexes = sorted({int(i * step) for i in range(sample_size)})
+        else:
+            sample_indexes = []
+
         temp_audio_folder_path = os.path.join(self.output_staging_directory, clip_audio_directory)
         os.makedirs(temp_audio_folder_path, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            futures = [
+                executor.submit(self.synthesize_sentence, sentences_list[i], i, temp_audio_folder_path, avg_prosody_rate)
+                for i in sample_indexes
+            ]
+            for future in futures:
+                future.result()
+
+        samples = [
+            (sentences_list[i]['default_rate_duration'], avg_prosody_rate, sentences_list[i]['actual_duration'])
+            for i in sample_indexes
+            if sentences_list[i]['default_rate_duration'] is not None and sentences_list[i]['actual_duration'] is not None
+        ]
+        duration_model = DurationModel(self.voice_name).fit(samples)
 
+        sampled = set(sample_indexes)
         for i, sentence in enumerate(sentences_list):
-            filename = os.path.join(temp_audio_folder_path, f"{self.prefix}_{i}.wav")
-            print(filename)
-            sentences_list[i]['audio_file'] = filename
-            
-            ## get the SSML for the sentence
-            phrase_ssml = self.build_ssml([sentence], insert_breaks=False, output_files = False, prosody_rate=avg_prosody_rate)
-            sentences_list[i]['phrase_ssml'] = phrase_ssml
-            
-            speech_synthesizer = self.get_speech_synthesizer(filename, )
-            print(f"This is the phrase_ssml: {phrase_ssml}")
-            resp = speech_synthesizer.speak_ssml_async(phrase_ssml).get()
-            
-            self.check_speech_result(resp, phrase_ssml)
+            sentence['duration_predicted'] = i not in sampled
+            if i not in sampled and sentence['default_rate_duration'] is not None:
+                sentence['actual_duration'] = duration_model.predict(sentence['default_rate_duration'], avg_prosody_rate)
 
-            sentences_list[i]['actual_duration'] = self.calculate_duration(sentence['audio_file'])       
-        
         self.sentences_list = sentences_list
-        return sentences_list
+        return duration_model.cross_validate(samples)
+
+    def solve_prosody_rates(self, sentences_list, timing_solver=None, clip_audio_directory="prosody_solved", max_iterations=3, max_concurrency=1, batch_min_mark=5):
+        ## Give every sentence its own prosody rate instead of one average for the whole file.
+        ## Only sentences the solver speeds up or slows down are re-synthesized; the measured durations
+        ## are fed back so a sentence that still misses its slot is solved again, up to max_iterations times.
+        timing_solver = timing_solver or TimingSolver()
+        with self.metrics.span('solve_prosody_rates', voice_language=self.voice_language):
+            ## start from the rate each clip was actually synthesized at, so its measured duration is
+            ## scaled back to rate 1 correctly (a re-dubbed average-mode run's clips were made at its average rate)
+            rates = [sentence.get('prosody_rate', 1) for sentence in sentences_list]
+            for sentence in sentences_list:
+                if sentence.get('default_rate_duration') is None:
+                    sentence['default_rate_duration'] = sentence['actual_duration']
+            sentence_table = self.sentence_table(sentences_list)
+            default_durations = [
+                duration * rate for duration, rate in zip(timing_solver.measured_durations(sentences_list), rates)
+            ]
+
+            temp_audio_folder_path = os.path.join(self.output_staging_directory, clip_audio_directory)
+            os.makedirs(temp_audio_folder_path, exist_ok=True)
+            resynthesized = 0
+            for iteration in range(max_iterations):
+                solved_rates = timing_solver.solve(sentence_table, default_durations, rates)
+                changed = [i for i, (old, new) in enumerate(zip(rates, solved_rates)) if new != old]
+                if not changed:
+                    break
+                rates = solved_rates
+                self.log(f"Timing solver pass {iteration + 1}: re-synthesizing {len(changed)} sentences")
+                with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+                    futures = []
+                    for i in changed:
+                        sentences_list[i]['solved_prosody_rate'] = rates[i]
+                        futures.append(executor.submit(self.synthesize_sentence, sentences_list[i], i, temp_audio_folder_path, rates[i]))
+                    for future in futures:
+                        future.result()
+                resynthesized += len(changed)
+                for i in changed:
+                    ## the voice rarely speeds up exactly by the rate, so solve the next pass from what it actually did
+                    if sentences_list[i]['actual_duration'] is not None:
+                        default_durations[i] = sentences_list[i]['actual_duration'] * rates[i]
+
+            for sentence, rate in zip(sentences_list, rates):
+                sentence['solved_prosody_rate'] = rate
+
+            ## report on the same batches the final synthesis will use
+            positions = {id(sentence): i for i, sentence in enumerate(sentences_list)}
+            batches = {
+                batch_num: [positions[id(sentence)] for sentence in batch]
+                for batch_num, batch in self.break_sentences_into_batches(sentences_list, batch_min_mark).items()
+            }
+            drift_report = timing_solver.drift_report(sentence_table, timing_solver.measured_durations(sentences_list), batches)
+            for batch_report in drift_report.values():
+                self.metrics.observe('batch_drift_seconds', batch_report['max_start_drift'], voice_language=self.voice_language)
+            self.metrics.incr('sentences_resynthesized_total', resynthesized, voice_language=self.voice_language)
+
+        self.sentences_list = sentences_list
+        return {'resynthesized': resynthesized, 'drift_target': timing_solver.drift_target, 'batches': drift_report}
+
+    def redub_from_previous(self, previous_sentences_path, max_concurrency=1, timing_solver=None):
+        ## Diff mode: re-dub against the enriched_sentences.json of an earlier run. Sentences whose text
+        ## is unchanged keep their audio (and take their timing from the new TTML); only changed and new
+        ## sentences are synthesized. Final batches whose SSML comes out identical are reused by
+        ## synthesize_batch from the earlier run's batch_audio directory.
+        with open(previous_sentences_path, 'r', encoding='utf-8') as f:
+            previous_sentences = json.load(f)
+        self.previous_batch_directories.append(os.path.join(os.path.dirname(previous_sentences_path), 'batch_audio'))
+
+        sentences_list = self.combine_ttml_to_sentences()
+        with self.metrics.span('redub_from_previous', voice_language=self.voice_language):
+            matches = align_sentences(previous_sentences, sentences_list)
+            changed = []
+            for i, sentence in enumerate(sentences_list):
+                previous = previous_sentences[matches[i]] if i in matches else None
+                if previous is None or not previous.get('audio_file') or not os.path.exists(previous['audio_file']):
+                    changed.append(i)
+                    continue
+                for field in REUSED_FIELDS:
+                    if field in previous:
+                        sentence[field] = previous[field]
+                sentence['reused'] = True
+            self.metrics.incr('sentences_reused_total', len(sentences_list) - len(changed), voice_language=self.voice_language)
+
+            ## changed sentences get a directory of their own so clips an earlier run still uses are never overwritten
+            clip_audio_directory = datetime.strftime(datetime.now(), "redub_%Y%m%d_%H%M%S")
+            temp_audio_folder_path = os.path.join(self.output_staging_directory, clip_audio_directory)
+            os.makedirs(temp_audio_folder_path, exist_ok=True)
+            prosody_rate = most_common_rate(previous_sentences)
+            with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+                futures = [
+                    executor.submit(self.synthesize_sentence, sentences_list[i], i, temp_audio_folder_path, prosody_rate, time.perf_counter())
+                    for i in changed
+                ]
+                for future in futures:
+                    future.result()
+
+        redub_report = {'sentences': len(sentences_list), 'reused': len(sentences_list) - len(changed), 'resynthesized': len(changed)}
+        if timing_solver is not None:
+            redub_report['timing'] = self.solve_prosody_rates(sentences_list, timing_solver=timing_solver, clip_audio_directory=clip_audio_directory, max_concurrency=max_concurrency)
+        self.sentences_list = sentences_list
+        return redub_report
+
+    def output_dead_letters(self, file_name='dead_letters.json', dead_letters=None):
+        path = os.path.join(self.output_staging_directory, file_name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.dead_letters if dead_letters is None else dead_letters, indent=4))
+        return path
 
     def output_sentences_list(self, file_name):
         path = os.path.join(self.output_staging_directory, file_name)
@@ -112,25 +371,39 @@ class TTMLConverter:
         with open(path, 'w', encoding='utf-8') as f:
             f.write(json.dumps(self.sentences_list, indent=4))
 
+    def sentence_table(self, sentences_list):
+        ## one table per sentences_list; begin, end and target durations are built once and only the
+        ## actual durations are re-read, since those are what synthesis fills in
+        if self._sentence_table_source is not sentences_list or len(self._sentence_table) != len(sentences_list):
+            self._sentence_table = SentenceTable.from_sentences(sentences_list)
+            self._sentence_table_source = sentences_list
+            return self._sentence_table
+        return self._sentence_table.refresh_actual_durations(sentences_list)
+
     def calculate_prosody_rates(self, sentences_list):
-        return_dict = {}
-        for i, sentence in enumerate(sentences_list):
-            sentences_list[i]["phrase_prosody_rate"] = sentences_list[i]["actual_duration"] / sentences_list[i]["target_duration"]
+        with self.metrics.span('calculate_prosody_rates'):
+            return_dict = {}
+            ## computed column-wise; sentences that failed to synthesize come out as NaN and are skipped
+            sentence_table = self.sentence_table(sentences_list)
+            phrase_prosody_rates = sentence_table.prosody_rates()
+            for sentence, rate in zip(sentences_list, phrase_prosody_rates):
+                if not math.isnan(rate):
+                    sentence["phrase_prosody_rate"] = float(rate)
 
-        prosody_rates = [sentence['phrase_prosody_rate'] for sentence in sentences_list]
-        avg_prosody_rate = sum(prosody_rates) / len(prosody_rates)
+            prosody_rates = [sentence['phrase_prosody_rate'] for sentence in sentences_list if 'phrase_prosody_rate' in sentence]
+            avg_prosody_rate = SentenceTable.nanmean(phrase_prosody_rates, default=1)
         
-        ## if the synthesized voice is already talking on average faster than the source voice,
-        ## don't change the rate. We will use breaks to maintain the timing. 
-        if avg_prosody_rate > 1:
-            avg_prosody_rate = 1
+            ## if the synthesized voice is already talking on average faster than the source voice,
+            ## don't change the rate. We will use breaks to maintain the timing. 
+            if avg_prosody_rate > 1:
+                avg_prosody_rate = 1
         
-        return_dict['avg_prosody'] = avg_prosody_rate
-        return_dict['prosody_rates'] = prosody_rates
-        return_dict['list'] = sentences_list
-        self.sentences_list = sentences_list
+            return_dict['avg_prosody'] = avg_prosody_rate
+            return_dict['prosody_rates'] = prosody_rates
+            return_dict['list'] = sentences_list
+            self.sentences_list = sentences_list
         
-        return return_dict
+            return return_dict
 
     def calculate_duration(self, wave_filename):
         with contextlib.closing(wave.open(wave_filename, 'r')) as f:
@@ -140,20 +413,23 @@ class TTMLConverter:
         return duration
 
     def break_sentences_into_batches(self, sentences_list, batch_min_mark=5):
-        ## break the transcript into 5 minutes at a time (to avoid the 10 minute audio limit of the invidual synthesis)
-        sentence_batch_lists = {}
-        batch_num = 0
-        time_start = datetime.strptime("00:00:00.000", "%H:%M:%S.%f")
-
-        for sentence in sentences_list: 
-            t = datetime.strptime(sentence['end'], "%H:%M:%S.%f")
-            delta = t - time_start
-            batch_num = int(delta.total_seconds() / 60 // int(batch_min_mark))    
-            if batch_num not in sentence_batch_lists.keys():
-                sentence_batch_lists[batch_num] = []
-            sentence_batch_lists[batch_num].append(sentence)
-        print(f"Breaking sentences into {len(sentence_batch_lists.items())} batches.")
-        return sentence_batch_lists
+        with self.metrics.span('break_sentences_into_batches'):
+            if self.batch_partitioner is not None:
+                sentence_batch_lists = self.batch_partitioner.partition(sentences_list)
+                self.log(f"Packed sentences into {len(sentence_batch_lists)} batches.")
+                return sentence_batch_lists
+
+            ## break the transcript into 5 minutes at a time (to avoid the 10 minute audio limit of the invidual synthesis)
+            sentence_batch_lists = {}
+            batch_numbers = self.sentence_table(sentences_list).batch_numbers(batch_min_mark)
+
+            for sentence, batch_num in zip(sentences_list, batch_numbers): 
+                batch_num = int(batch_num)
+                if batch_num not in sentence_batch_lists.keys():
+                    sentence_batch_lists[batch_num] = []
+                sentence_batch_lists[batch_num].append(sentence)
+            self.log(f"Breaking sentences into {len(sentence_batch_lists.items())} batches.")
+            return sentence_batch_lists
 
     def generate_ssml_breaks(self, parent_xml, break_length_in_sec) -> xml.Element:
         max_break_length_in_sec = 5
@@ -187,22 +463,29 @@ class TTMLConverter:
         root.append(voice_element)
         prosody_element = xml.Element('prosody', attrib={'rate':f'{prosody_rate}'})
         voice_element.append(prosody_element)
+        current_rate = prosody_rate
 
-        # latest_timestamp = datetime.strptime("00:00:00.000", "%H:%M:%S.%f")
-        # next_timestamp = datetime.strptime("00:00:00.000", "%H:%M:%S.%f")
         accumulated_overage_time = 0
         
         ## Insert starting break
         if insert_breaks == True:
-            file_start = datetime.strptime(file_start, "%H:%M:%S.%f")
-            first_time_stamp = datetime.strptime(sentences_list[0]['begin'], "%H:%M:%S.%f")
-            starting_break_sec = (first_time_stamp - file_start).total_seconds()
+            starting_break_sec = timestamp_seconds(sentences_list[0], 'begin') - parse_time_expression(file_start)
             
             ## Put any breaks that precede the sentence
             self.generate_ssml_breaks(prosody_element, starting_break_sec)
 
+        ## the slot of each sentence runs until the next sentence begins, so the silence between captions is kept too
+        slot_durations = SentenceTable.from_sentences(sentences_list).slot_durations().tolist() if insert_breaks else []
+
         ## for each sentence, generate the objects and corresponding breaks
-        for sentence in sentences_list:
+        for i, sentence in enumerate(sentences_list):
+            ## sentences with a solved rate get their own prosody element (consecutive equal rates share one)
+            sentence_rate = sentence.get('solved_prosody_rate', prosody_rate)
+            if float(sentence_rate) != float(current_rate):
+                prosody_element = xml.Element('prosody', attrib={'rate':f'{sentence_rate}'})
+                voice_element.append(prosody_element)
+                current_rate = sentence_rate
+
             ## Create the sentence
             # sentence_element = xml.Element("s", attrib={"duration": str(int(sentence['actual_duration']*1000))})
             sentence_element = xml.Element("s")
@@ -213,7 +496,9 @@ class TTMLConverter:
 
             if insert_breaks == True:
                 ## Put any breaks needed after the sentence
-                sentence_gap_in_sec = sentence['target_duration'] - sentence['actual_duration']
+                ## a sentence that failed to synthesize is assumed to fill its slot exactly
+                actual_duration = sentence['actual_duration'] if sentence.get('actual_duration') is not None else sentence['target_duration']
+                sentence_gap_in_sec = slot_durations[i] - actual_duration
                 if sentence_gap_in_sec >= 0: ## if the generated audio is shorter than the target audio
                     
                     ## Add the appropriate filler gap, removing any accumulated overages
@@ -224,14 +509,14 @@ class TTMLConverter:
 
                     if break_duration > 0:
                         ## create breaks, zero out the accumulated time
-                        self.generate_ssml_breaks(prosody_element, sentence_gap_in_sec)
+                        self.generate_ssml_breaks(prosody_element, break_duration)
                         accumulated_overage_time = 0
                     else: 
                         ## otherwise, just update the accumulated overage time
                         ## skip creating a break
                         accumulated_overage_time = break_duration
                 else:
-                    accumulated_overage_time =+ sentence_gap_in_sec        
+                    accumulated_overage_time += sentence_gap_in_sec
             
         ssml_string = str(xml.tostring(root, encoding='utf-8'), encoding='utf-8')
         
@@ -243,40 +528,109 @@ class TTMLConverter:
 
         return ssml_string
 
-    def check_speech_result(self,result, text):
-        from azure.cognitiveservices.speech import ResultReason, CancellationReason
-        if result.reason == ResultReason.SynthesizingAudioCompleted:
-            print("Speech synthesized for text [{}]".format(text))
-        elif result.reason == ResultReason.Canceled:
-            cancellation_details = result.cancellation_details
-            print("Speech synthesis canceled: {}".format(cancellation_details.reason))
-            print("Supplied text was ", text)
-            if cancellation_details.reason == CancellationReason.Error:
-                if cancellation_details.error_details:
-                    print("Error details: {}".format(cancellation_details.error_details))
-            print("Did you update the subscription info?")
-    
-    def get_speech_synthesizer(self, output_filename = None, speech_synthesis_output_format = None):
-        speech_config = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.service_region)
-        speech_config.speech_synthesis_language = self.voice_language
-        speech_config.speech_synthesis_voice_name = self.voice_name
-        ## TODO: take the output audio format as a parameter
-        if not speech_synthesis_output_format:
-            speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat[self.target_audio_format])
+    def assemble_final_audio(self, sentences_list, assembly='ssml', overlap='shift', batch_min_mark=5, max_concurrency=1):
+        ## Produce the dubbed audio track, either by stitching the sentence clips locally
+        ## or by synthesizing the batched SSML with breaks. Returns the output path.
+        with self.metrics.span('assemble_final_audio', assembly=assembly, voice_language=self.voice_language):
+            if assembly == 'stitch':
+                ## place the sentence clips we already have at their caption offsets instead of synthesizing again
+                stitcher = AudioStitcher(overlap=overlap)
+                final_audio_path = os.path.join(self.output_staging_directory, f"{self.voice_language}_generated_audio.wav")
+                timeline_duration = stitcher.assemble(sentences_list, final_audio_path)
+                self.log(f"Stitched {timeline_duration:.1f} seconds of audio into {final_audio_path}")
+                if shutil.which('ffmpeg'):
+                    stitcher.encode_mp3(final_audio_path, os.path.splitext(final_audio_path)[0] + '.mp3')
+                return final_audio_path
+
+            ## generate the ssml for each the created batches and submit the ssml to the audio for processing
+            ## appending to the same target file, which allows us to exceed the 10 minute limit.
+            sentence_batch_dict = self.break_sentences_into_batches(sentences_list, batch_min_mark=batch_min_mark)
+            final_audio_format = 'Audio24Khz96KBitRateMonoMp3'
+            final_audio_path = os.path.join(self.output_staging_directory, f"{self.voice_language}_generated_audio.mp3")
+            if os.path.exists(final_audio_path):
+                os.remove(final_audio_path)
+
+            ## every batch starts where the previous one's last sentence ends, so all of them can be
+            ## synthesized at once; the results are written back in batch order
+            start_file_time = "00:00:00.000"
+            with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+                futures = []
+                for index, batch in sentence_batch_dict.items():
+                    futures.append(executor.submit(self.synthesize_batch, batch, index, start_file_time, final_audio_format))
+                    start_file_time = batch[-1]['end']
+                for future in futures:
+                    ## MP3 frames can be concatenated, so each batch is appended to the same output file
+                    self.write_audio_data(future.result(), final_audio_path, append=True)
+            return final_audio_path
+
+    def synthesize_batch(self, batch, index, start_file_time, speech_synthesis_output_format):
+        self.log(f"Generating and submitting SSML for batch {index} starting at {start_file_time}")
+        with self.metrics.span('build_ssml'):
+            batch_ssml = self.build_ssml(batch, output_file_num=index, file_start=start_file_time)
+
+        ## batch audio is kept under its SSML hash so a later re-dub can reuse batches that did not change
+        batch_hash = self.synthesis_key(batch_ssml, speech_synthesis_output_format)
+        batch_audio_path = os.path.join(self.output_staging_directory, 'batch_audio', f"{batch_hash}.mp3")
+        os.makedirs(os.path.dirname(batch_audio_path), exist_ok=True)
+        for directory in [os.path.dirname(batch_audio_path)] + self.previous_batch_directories:
+            previous_path = os.path.join(directory, f"{batch_hash}.mp3")
+            if os.path.exists(previous_path):
+                self.log(f"Reusing audio for batch {index} from {previous_path}")
+                self.metrics.incr('batches_reused_total', voice_language=self.voice_language)
+                if previous_path != batch_audio_path:
+                    shutil.copyfile(previous_path, batch_audio_path)
+                with open(batch_audio_path, 'rb') as f:
+                    return f.read()
+
+        batch_audio = self.synthesize_ssml(batch_ssml, speech_synthesis_output_format=speech_synthesis_output_format, description=f"SSML for batch {index}")
+        self.write_audio_data(batch_audio, batch_audio_path)
+        return batch_audio
+
+    def get_synthesis_backend(self):
+        ## created lazily because the key and region are assigned after construction
+        if self.synthesis_backend is None:
+            self.synthesis_backend = AzureSpeechBackend(self.speech_key, self.service_region)
+        return self.synthesis_backend
+
+    def synthesis_key(self, ssml, output_format):
+        ## identifies synthesized audio for the cache, the job manifest and batch reuse
+        return SynthesisCache.make_key(ssml, self.voice_name, self.voice_language, output_format, self.get_synthesis_backend().name)
+
+    def synthesize_ssml(self, ssml, speech_synthesis_output_format=None, description=None):
+        ## Returns the synthesized audio bytes, serving them from the synthesis cache when possible
+        output_format = speech_synthesis_output_format or self.target_audio_format
+        cache_key = None
+        if self.synthesis_cache is not None:
+            cache_key = self.synthesis_key(ssml, output_format)
+            audio_data = self.synthesis_cache.get(cache_key)
+            if audio_data is not None:
+                self.metrics.incr('synthesis_cache_hits_total')
+                return audio_data
+            self.metrics.incr('synthesis_cache_misses_total')
+
+        if self.request_scheduler is not None:
+            audio_data = self.request_scheduler.call(lambda: self.speak_ssml_checked(ssml, output_format, description), job=self.job_name)
         else:
-            speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat[speech_synthesis_output_format])
-        if not output_filename:
-            audio_filename = f"{self.voice_language}_generated_audio.mp3"
-            output_filename = os.path.join(self.output_staging_directory, audio_filename)
-        audio_config = speechsdk.audio.AudioConfig(filename=output_filename)
-        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
-        return speech_synthesizer
-
-    def get_synthesized_speech(self, text, voice_name, voice_language, output_filename, speech_key, service_region):
-        speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
-        speech_config.speech_synthesis_language = voice_language
-        speech_config.speech_synthesis_voice_name = voice_name
-        audio_config = speechsdk.AudioConfig(filename=output_filename)
-        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
-        resp = speech_synthesizer.speak_text_async(text).get()
-        self.check_speech_result(resp, text)
\ No newline at end of file
+            audio_data = self.speak_ssml_checked(ssml, output_format, description)
+        ## only completed results get here, a canceled request raised and will be retried next time
+        if cache_key is not None:
+            self.synthesis_cache.put(cache_key, audio_data)
+        return audio_data
+
+    def speak_ssml_checked(self, ssml, output_format, description=None):
+        try:
+            with self.metrics.span('synthesis_request', voice_language=self.voice_language):
+                audio_data = self.get_synthesis_backend().synthesize(ssml, self.voice_name, self.voice_language, output_format)
+        except SynthesisError as e:
+            ## throttles and retries are counted, not printed; sentences that never succeed end up in the dead letters
+            self.metrics.incr('synthesis_errors_total', error=type(e).__name__)
+            self.log("Speech synthesis canceled for [{}]: {}".format(description or 'SSML', e))
+            raise
+        self.metrics.incr('synthesis_requests_total', voice_language=self.voice_language)
+        self.metrics.incr('audio_bytes_total', len(audio_data), voice_language=self.voice_language)
+        self.log("Speech synthesized for text [{}]".format(description or ssml))
+        return audio_data
+
+    def write_audio_data(self, audio_data, output_filename, append=False):
+        with open(output_filename, 'ab' if append else 'wb') as f:
+            f.write(audio_data)
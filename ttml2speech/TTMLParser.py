@@ -0,0 +1,130 @@
+import re
+import xml.etree.ElementTree as xml
+
+TTML_PARAMETER_NS = 'http://www.w3.org/ns/ttml#parameter'
+
+CLOCK_TIME = re.compile(r'^(\d+):(\d{2}):(\d{2})(?:(\.\d+)|:(\d+)(?:\.(\d+))?)?$')
+OFFSET_TIME = re.compile(r'^(\d+(?:\.\d+)?)(h|ms|m|s|f|t)$')
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_time_expression(value, frame_rate=30.0, sub_frame_rate=1.0, tick_rate=1.0):
+    ## Convert a TTML time expression to seconds. Supports clock time (HH:MM:SS.fff and
+    ## HH:MM:SS:frames.subframes) and offset time (h, m, s, ms, f and t metrics).
+    value = value.strip()
+    match = CLOCK_TIME.match(value)
+    if match:
+        hours, minutes, seconds, fraction, frames, sub_frames = match.groups()
+        total = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+        if fraction:
+            total += float(fraction)
+        if frames:
+            total += int(frames) / frame_rate
+        if sub_frames:
+            total += int(sub_frames) / sub_frame_rate / frame_rate
+        return total
+
+    match = OFFSET_TIME.match(value)
+    if match:
+        count, metric = float(match.group(1)), match.group(2)
+        if metric == 'h':
+            return count * 3600
+        if metric == 'm':
+            return count * 60
+        if metric == 's':
+            return count
+        if metric == 'ms':
+            return count / 1000
+        if metric == 'f':
+            return count / frame_rate
+        return count / tick_rate
+    raise ValueError(f"Unsupported TTML time expression: {value}")
+
+
+def format_timestamp(seconds):
+    ## Format seconds as the HH:MM:SS.fff clock time used throughout the converter
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    return f"{hours:02d}:{minutes:02d}:{milliseconds / 1000:06.3f}"
+
+
+def element_text(element):
+    ## Flatten a <p> including nested <span>s; <br/> becomes a space
+    parts = [element.text or '']
+    for child in element:
+        if local_name(child.tag) == 'br':
+            parts.append(' ')
+        else:
+            parts.append(element_text(child))
+        parts.append(child.tail or '')
+    return ' '.join(''.join(parts).split())
+
+
+def timing_parameters(tt_element):
+    frame_rate = float(tt_element.get(f'{{{TTML_PARAMETER_NS}}}frameRate', 30))
+    multiplier = tt_element.get(f'{{{TTML_PARAMETER_NS}}}frameRateMultiplier')
+    if multiplier:
+        numerator, denominator = multiplier.split()
+        frame_rate = frame_rate * float(numerator) / float(denominator)
+    return {
+        'frame_rate': frame_rate,
+        'sub_frame_rate': float(tt_element.get(f'{{{TTML_PARAMETER_NS}}}subFrameRate', 1)),
+        'tick_rate': float(tt_element.get(f'{{{TTML_PARAMETER_NS}}}tickRate', 1)),
+    }
+
+
+def iter_ttml_sentences(source):
+    ## Incrementally parse a TTML file path or binary file object and yield sentence dicts as soon
+    ## as each sentence is complete. Caption <p> elements are joined until one ends in . ! or ?
+    ## Finished elements are removed from the tree so memory stays flat for very large documents.
+    parameters = {'frame_rate': 30.0, 'sub_frame_rate': 1.0, 'tick_rate': 1.0}
+    stack = []
+    text = ''
+    begin = None
+    end = None
+
+    for event, element in xml.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            if local_name(element.tag) == 'tt':
+                parameters = timing_parameters(element)
+            continue
+
+        stack.pop()
+        if local_name(element.tag) != 'p':
+            continue
+
+        phrase_text = element_text(element)
+        phrase_begin = element.get('begin')
+        if phrase_text and phrase_begin is not None:
+            phrase_begin = parse_time_expression(phrase_begin, **parameters)
+            if element.get('end') is not None:
+                phrase_end = parse_time_expression(element.get('end'), **parameters)
+            else:
+                phrase_end = phrase_begin + parse_time_expression(element.get('dur', '0s'), **parameters)
+
+            begin = phrase_begin if begin is None else min(begin, phrase_begin)
+            end = phrase_end if end is None else max(end, phrase_end)
+            text = phrase_text if not text else text + " " + phrase_text
+
+            ## If this is the end of a sentence, hand it to the caller
+            if phrase_text[-1] in ".!?":
+                yield {
+                    'text': text,
+                    'begin': format_timestamp(begin),
+                    'end': format_timestamp(end),
+                    'target_duration': round(end - begin, 6),
+                    'character_length': len(text),
+                    'begin_seconds': round(begin, 6),
+                    'end_seconds': round(end, 6),
+                }
+                text = ''
+                begin = None
+                end = None
+
+        if stack:
+            stack[-1].remove(element)
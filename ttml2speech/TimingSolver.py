@@ -0,0 +1,85 @@
+import math
+
+
+class TimingSolver:
+    ## Picks a prosody rate per sentence so the synthesized timeline stays within drift_target
+    ## seconds of the caption timing. Sentences are walked in order: each one starts at its caption
+    ## begin or when the previous one finishes, whichever is later, and may run until the next
+    ## caption begins. A sentence is sped up (never past max_rate) when letting it run at its
+    ## current rate would push the timeline more than drift_target behind, and slowed down (never
+    ## past min_rate) when it would fill less than min_fill of its slot; sentences in between are
+    ## never re-synthesized. Rates are rounded up to rate_step so repeated runs produce the same
+    ## SSML (and hit the synthesis cache), and a slowed sentence never overruns its slot.
+    def __init__(self, min_rate=0.8, max_rate=1.5, drift_target=0.5, rate_step=0.05, min_fill=0.7):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.drift_target = drift_target
+        self.rate_step = rate_step
+        self.min_fill = min_fill
+
+    def quantize_up(self, rate):
+        steps = math.ceil(round(rate / self.rate_step, 6))
+        return min(self.max_rate, max(self.min_rate, round(steps * self.rate_step, 4)))
+
+    def simulate(self, sentence_table, durations):
+        ## start drift (how late each sentence starts) for the given spoken durations;
+        ## a sentence without a duration (failed) is assumed to fill its caption slot exactly
+        drifts = []
+        cursor = 0.0
+        for begin, target_duration, duration in zip(sentence_table.begin.tolist(), sentence_table.target_duration.tolist(), durations):
+            if math.isnan(duration):
+                duration = target_duration
+            start = max(begin, cursor)
+            drifts.append(start - begin)
+            cursor = start + duration
+        return drifts, cursor
+
+    def solve(self, sentence_table, default_durations, current_rates=None):
+        ## default_durations are the lengths at rate 1; returns the rate for every sentence.
+        ## current_rates come from a previous iteration; a sentence that was sped up is never slowed again.
+        count = len(sentence_table)
+        rates = list(current_rates) if current_rates is not None else [1.0] * count
+        begins = sentence_table.begin.tolist()
+        slot_ends = begins[1:] + sentence_table.end.tolist()[-1:]
+        target_durations = sentence_table.target_duration.tolist()
+        cursor = 0.0
+        for i in range(count):
+            begin = begins[i]
+            slot_end = slot_ends[i]
+            start = max(begin, cursor)
+            default_duration = default_durations[i]
+            if math.isnan(default_duration):
+                cursor = start + target_durations[i]
+                continue
+            spoken = default_duration / rates[i]
+            if start + spoken > slot_end + self.drift_target:
+                available = slot_end + self.drift_target - start
+                needed = default_duration / available if available > 0 else self.max_rate
+                rates[i] = max(rates[i], self.quantize_up(needed))
+            elif rates[i] <= 1.0 and default_duration > 0 and spoken < self.min_fill * (slot_end - start):
+                ## badly underfilled: stretch it towards the end of its slot instead of leaving a long break
+                rates[i] = min(rates[i], self.quantize_up(default_duration / (slot_end - start)))
+            cursor = start + default_duration / rates[i]
+        return rates
+
+    def drift_report(self, sentence_table, durations, batches):
+        ## drift per batch: batches maps batch number -> list of sentence indexes
+        drifts, _ = self.simulate(sentence_table, durations)
+        target_durations = sentence_table.target_duration.tolist()
+        report = {}
+        for batch_num, indexes in batches.items():
+            batch_drifts = [drifts[i] for i in indexes]
+            last = indexes[-1]
+            last_duration = target_durations[last] if math.isnan(durations[last]) else durations[last]
+            end_drift = drifts[last] + last_duration - target_durations[last]
+            report[batch_num] = {
+                'sentences': len(indexes),
+                'max_start_drift': round(max(batch_drifts), 3),
+                'end_drift': round(max(0.0, end_drift), 3),
+                'within_target': max(batch_drifts) <= self.drift_target,
+            }
+        return report
+
+    @staticmethod
+    def measured_durations(sentences_list, key='actual_duration'):
+        return [float('nan') if s.get(key) is None else s[key] for s in sentences_list]